@@ -0,0 +1,43 @@
+# Per-request cost of resolving the bearer token in get_current_user, with
+# the verified-token cache disabled (a full jwt.decode every time) and warm.
+#
+#   python -m benchmarks.auth_overhead --iterations 20000
+import argparse
+import asyncio
+import time
+from datetime import timedelta
+
+from routers.auth import create_access_token, get_current_user
+from services.tokens import token_cache
+
+
+async def measure(iterations: int, tokens: list[str]) -> float:
+    start = time.perf_counter()
+    for i in range(iterations):
+        await get_current_user(tokens[i % len(tokens)])
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+async def main(args):
+    tokens = [create_access_token(f"bench_{i}", i, timedelta(minutes=30)) for i in range(args.users)]
+
+    max_size = token_cache.max_size
+    token_cache.max_size = 0
+    token_cache.clear()
+    uncached = await measure(args.iterations, tokens)
+
+    token_cache.max_size = max_size
+    for token in tokens:
+        await get_current_user(token)
+    cached = await measure(args.iterations, tokens)
+
+    print(f"{args.iterations} lookups over {args.users} distinct tokens")
+    print(f"jwt.decode every request: {uncached:8.2f} us/request")
+    print(f"verified-token cache:     {cached:8.2f} us/request ({uncached / cached:.1f}x)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=20000)
+    parser.add_argument("--users", type=int, default=1000)
+    asyncio.run(main(parser.parse_args()))
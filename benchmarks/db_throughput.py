@@ -0,0 +1,61 @@
+# Compares request throughput of async handlers that query through the old
+# blocking SessionLocal against the AsyncSessionLocal they use now.
+#
+#   python -m benchmarks.db_throughput --requests 500 --concurrency 50
+import argparse
+import asyncio
+import time
+
+from sqlalchemy import text
+
+from database import AsyncSessionLocal, SessionLocal, async_engine, engine
+
+QUERY = text("SELECT pg_sleep(:seconds)")
+
+
+async def sync_handler(seconds: float):
+    db = SessionLocal()
+    try:
+        db.execute(QUERY, {"seconds": seconds})
+    finally:
+        db.close()
+
+
+async def async_handler(seconds: float):
+    async with AsyncSessionLocal() as db:
+        await db.execute(QUERY, {"seconds": seconds})
+
+
+async def run(handler, requests: int, concurrency: int, seconds: float) -> float:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            await handler(seconds)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    return requests / (time.perf_counter() - start)
+
+
+async def main(args):
+    await async_handler(0)
+    await sync_handler(0)
+
+    sync_rps = await run(sync_handler, args.requests, args.concurrency, args.query_ms / 1000)
+    async_rps = await run(async_handler, args.requests, args.concurrency, args.query_ms / 1000)
+
+    print(f"{args.requests} requests, concurrency {args.concurrency}, {args.query_ms}ms per query")
+    print(f"sync session:  {sync_rps:8.1f} req/s")
+    print(f"async session: {async_rps:8.1f} req/s ({async_rps / sync_rps:.1f}x)")
+
+    await async_engine.dispose()
+    engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--query-ms", type=float, default=5)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,82 @@
+# Memory and lookup cost of the in-memory follow graph on a synthetic graph,
+# next to the primary-key lookup is_following used to run against follows.
+#
+#   python -m benchmarks.follow_graph --users 100000 --edges 1000000
+import argparse
+import asyncio
+import random
+import time
+
+from sqlalchemy import select
+
+from database import AsyncSessionLocal
+from models import Follow
+from services.follow_graph import FollowGraph
+
+
+def synthetic_edges(users: int, edges: int, seed: int) -> list[tuple[int, int]]:
+    # Skewed like a real graph: a few accounts collect most of the follows.
+    rng = random.Random(seed)
+    pairs = set()
+    while len(pairs) < edges:
+        follower = rng.randrange(1, users + 1)
+        following = min(int(rng.paretovariate(1.2)), users)
+        pairs.add((follower, following if following != follower else users - follower + 1))
+    return sorted(pairs)
+
+
+def time_lookups(graph: FollowGraph, queries: list[tuple[int, int]]) -> float:
+    start = time.perf_counter()
+    for follower, following in queries:
+        graph.is_following(follower, following)
+    return (time.perf_counter() - start) / len(queries) * 1e6
+
+
+async def time_db_lookups(queries: list[tuple[int, int]]) -> float:
+    async with AsyncSessionLocal() as db:
+        start = time.perf_counter()
+        for follower, following in queries:
+            await db.scalar(
+                select(Follow.follower_id).where(Follow.follower_id == follower, Follow.following_id == following)
+            )
+        return (time.perf_counter() - start) / len(queries) * 1e6
+
+
+async def main(args):
+    edges = synthetic_edges(args.users, args.edges, args.seed)
+
+    graph = FollowGraph()
+    start = time.perf_counter()
+    graph.edges = FollowGraph.extend(graph.following, edges)
+    build = time.perf_counter() - start
+    snapshot = graph.snapshot()
+
+    rng = random.Random(args.seed + 1)
+    queries = [rng.choice(edges) for _ in range(args.lookups // 2)]
+    queries += [(rng.randrange(1, args.users + 1), rng.randrange(1, args.users + 1)) for _ in range(args.lookups // 2)]
+    rng.shuffle(queries)
+    lookup = time_lookups(graph, queries)
+
+    start = time.perf_counter()
+    for follower, following in queries[:1000]:
+        graph.remove(follower, following)
+        graph.add(follower, following)
+    update = (time.perf_counter() - start) / 2000 * 1e6
+
+    print(f"{snapshot['edges']} edges over {snapshot['users']} followers, built in {build:.2f}s")
+    print(f"memory: {snapshot['bytes'] / 2**20:.1f} MiB, {snapshot['bytes_per_edge']} B/edge, "
+          f"{snapshot['mb_per_million_edges']} MiB per million edges")
+    print(f"is_following (index):   {lookup:8.2f} us")
+    print(f"follow/unfollow update: {update:8.2f} us")
+    if args.db_lookups:
+        print(f"is_following (db):      {await time_db_lookups(queries[:args.db_lookups]):8.2f} us")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--edges", type=int, default=1000000)
+    parser.add_argument("--lookups", type=int, default=200000)
+    parser.add_argument("--db-lookups", type=int, default=2000, help="0 to skip the database comparison")
+    parser.add_argument("--seed", type=int, default=7)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,88 @@
+# Latency of an unrelated endpoint (the post feed) while a burst of logins
+# runs on the same worker, with bcrypt inline in the handler (as before) and
+# on the bounded password pool.
+#
+#   python -m benchmarks.login_burst --logins 40 --probes 200
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+
+import main
+from routers import auth
+from services.passwords import hasher, pwd_context
+
+USERNAME = "bench_login_burst"
+PASSWORD = "bench-password"
+
+
+class InlineHasher:
+    async def hash(self, password: str) -> str:
+        return pwd_context.hash(password)
+
+    async def verify(self, password: str, hashed: str) -> bool:
+        return pwd_context.verify(password, hashed)
+
+
+async def login(client: httpx.AsyncClient) -> int:
+    response = await client.post("/api/auth/token", data={"username": USERNAME, "password": PASSWORD})
+    return response.status_code
+
+
+async def probe(client: httpx.AsyncClient, headers: dict, count: int, interval: float) -> list[float]:
+    latencies = []
+    for _ in range(count):
+        start = time.perf_counter()
+        response = await client.get("/api/posts/", headers=headers, params={"limit": 20})
+        response.raise_for_status()
+        latencies.append((time.perf_counter() - start) * 1000)
+        await asyncio.sleep(interval)
+    return latencies
+
+
+def percentile(values: list[float], pct: float) -> float:
+    return statistics.quantiles(values, n=100)[int(pct) - 1]
+
+
+async def run(client: httpx.AsyncClient, headers: dict, args) -> tuple[list[float], list[int]]:
+    probes = asyncio.create_task(probe(client, headers, args.probes, args.interval_ms / 1000))
+    await asyncio.sleep(0.05)
+    statuses = await asyncio.gather(*(login(client) for _ in range(args.logins)))
+    return await probes, statuses
+
+
+async def main_async(args):
+    async with main.app.router.lifespan_context(main.app):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+            await client.post("/api/auth/", json={"username": USERNAME, "password": PASSWORD})
+            token = (await client.post("/api/auth/token", data={"username": USERNAME, "password": PASSWORD})).json()
+            headers = {"Authorization": f"Bearer {token['access_token']}"}
+            baseline = await probe(client, headers, args.probes, args.interval_ms / 1000)
+
+            auth.hasher = InlineHasher()
+            inline, inline_statuses = await run(client, headers, args)
+            auth.hasher = hasher
+            pooled, pooled_statuses = await run(client, headers, args)
+
+    print(f"{args.logins} concurrent logins, {args.probes} feed requests every {args.interval_ms}ms")
+    for label, latencies, statuses in (
+        ("no logins", baseline, []),
+        ("bcrypt inline", inline, inline_statuses),
+        ("bcrypt pool", pooled, pooled_statuses),
+    ):
+        codes = ", ".join(f"{code}: {statuses.count(code)}" for code in sorted(set(statuses)))
+        print(
+            f"{label:14} feed p50 {percentile(latencies, 50):8.1f} ms  p99 {percentile(latencies, 99):8.1f} ms  "
+            f"max {max(latencies):8.1f} ms  {'logins ' + codes if codes else ''}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--logins", type=int, default=40)
+    parser.add_argument("--probes", type=int, default=200)
+    parser.add_argument("--interval-ms", type=float, default=5)
+    asyncio.run(main_async(parser.parse_args()))
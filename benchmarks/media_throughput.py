@@ -0,0 +1,94 @@
+# Compares the /media router against a plain StaticFiles mount over the same
+# directory, in-process through httpx's ASGI transport.
+#
+#   python -m benchmarks.media_throughput --requests 2000 --concurrency 50
+#
+# The ASGI transport offers no zerocopysend/pathsend extension, so both sides
+# read files through a thread here; run behind a server that offers one to
+# see the sendfile path.
+import argparse
+import asyncio
+import os
+import shutil
+import time
+
+import httpx
+from fastapi import FastAPI
+from fastapi.staticfiles import StaticFiles
+
+from routers import media
+from services.uploads import MEDIA_DIR
+
+BENCH_DIR = MEDIA_DIR / "bench"
+
+FILES = {
+    "image.jpg": 200 * 1024,
+    "video.mp4": 8 * 1024 * 1024,
+}
+
+# label, file, request headers, share of --requests to send
+CASES = [
+    ("image, full", "image.jpg", {}, 1),
+    ("video, 1MB range", "video.mp4", {"Range": "bytes=1048576-2097151"}, 1),
+    ("video, full", "video.mp4", {}, 0.1),
+]
+
+
+def build_app() -> FastAPI:
+    app = FastAPI()
+    app.include_router(media.router)
+    app.mount("/static", StaticFiles(directory=MEDIA_DIR), name="static")
+    return app
+
+
+async def run(client: httpx.AsyncClient, url: str, headers: dict, requests: int, concurrency: int) -> tuple[float, float]:
+    semaphore = asyncio.Semaphore(concurrency)
+    received = 0
+
+    async def one():
+        nonlocal received
+        async with semaphore:
+            response = await client.get(url, headers=headers)
+            if response.status_code >= 400:
+                response.raise_for_status()
+            received += len(response.content)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    elapsed = time.perf_counter() - start
+    return requests / elapsed, received / elapsed / (1024 * 1024)
+
+
+async def main(args):
+    BENCH_DIR.mkdir(parents=True, exist_ok=True)
+    for name, size in FILES.items():
+        (BENCH_DIR / name).write_bytes(os.urandom(size))
+
+    transport = httpx.ASGITransport(app=build_app())
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            etag = (await client.get("/media/bench/image.jpg")).headers["etag"]
+            cases = CASES + [("image, If-None-Match", "image.jpg", {"If-None-Match": etag}, 1)]
+
+            print(f"{args.requests} requests, concurrency {args.concurrency}")
+            for label, name, headers, share in cases:
+                requests = max(int(args.requests * share), 1)
+                media_rps, media_mbs = await run(client, f"/media/bench/{name}", headers, requests, args.concurrency)
+                if "If-None-Match" in headers:
+                    # StaticFiles only honours validators it generated itself.
+                    static_etag = (await client.get(f"/static/bench/{name}")).headers["etag"]
+                    headers = {"If-None-Match": static_etag}
+                static_rps, static_mbs = await run(client, f"/static/bench/{name}", headers, requests, args.concurrency)
+                print(
+                    f"{label:22} media {media_rps:8.1f} req/s {media_mbs:8.1f} MB/s   "
+                    f"static {static_rps:8.1f} req/s {static_mbs:8.1f} MB/s"
+                )
+    finally:
+        shutil.rmtree(BENCH_DIR, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,195 @@
+# Seeds a scratch database with a realistic volume of rows, runs EXPLAIN
+# ANALYZE on the queries behind the hot router paths and exits non-zero if
+# any of them falls back to a sequential scan.
+#
+#   BENCH_DATABASE_URL=postgresql://.../ig_bench python -m benchmarks.query_plans
+#
+# The target database is wiped first, so never point it at real data.
+import argparse
+import json
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import create_engine, select, text
+
+from database import Base, DATABASE_URL
+from migrations import run_migrations
+from models import Follow
+from routers.chat import dm_previews_query, message_page_query, unread_messages_query
+from routers.post import post_comments_query, post_page_query
+from routers.reels import reel_comments_query
+from routers.story import following_stories_query, seen_story_ids_query
+from routers.user import follow_page_query, user_posts_query, user_reels_query
+from services.timeline import large_account_posts_query, timeline_page_query
+
+SEED = [
+    """
+    INSERT INTO users (id, username, hashed_password, posts_count, followers_count, following_count, created_at)
+    SELECT g, 'bench_' || g, 'x', 0, 0, 0, NOW() - random() * INTERVAL '365 days'
+    FROM generate_series(1, :users) AS g
+    """,
+    "SELECT setval(pg_get_serial_sequence('users', 'id'), :users)",
+    """
+    INSERT INTO follows (follower_id, following_id, followed_at)
+    SELECT f, 1 + (f + k * 7919) % :users, NOW() - random() * INTERVAL '365 days'
+    FROM generate_series(1, :users) AS f, generate_series(1, :follows_per_user) AS k
+    WHERE 1 + (f + k * 7919) % :users <> f
+    ON CONFLICT DO NOTHING
+    """,
+    """
+    INSERT INTO posts (user_id, media_url, like_count, comment_count, created_at)
+    SELECT 1 + (random() * (:users - 1))::int, 'bench', 0, 0, NOW() - random() * INTERVAL '365 days'
+    FROM generate_series(1, :posts)
+    """,
+    """
+    INSERT INTO post_comments (post_id, user_id, content, created_at)
+    SELECT 1 + (random() * (:posts - 1))::int, 1 + (random() * (:users - 1))::int, 'c',
+           NOW() - random() * INTERVAL '365 days'
+    FROM generate_series(1, :posts * 2)
+    """,
+    """
+    INSERT INTO post_views (post_id, user_id, viewed_at)
+    SELECT 1 + (random() * (:posts - 1))::int, 1 + (random() * (:users - 1))::int, NOW()
+    FROM generate_series(1, :posts)
+    """,
+    """
+    INSERT INTO reels (user_id, video_url, like_count, comment_count, created_at)
+    SELECT 1 + (random() * (:users - 1))::int, 'bench', 0, 0, NOW() - random() * INTERVAL '365 days'
+    FROM generate_series(1, :posts / 4)
+    """,
+    """
+    INSERT INTO reel_comments (reel_id, user_id, content, created_at)
+    SELECT 1 + (random() * (:posts / 4 - 1))::int, 1 + (random() * (:users - 1))::int, 'c',
+           NOW() - random() * INTERVAL '365 days'
+    FROM generate_series(1, :posts)
+    """,
+    """
+    INSERT INTO stories (user_id, media_url, created_at, expires_at)
+    SELECT u, 'bench', t, t + INTERVAL '1 day'
+    FROM (
+        SELECT 1 + (random() * (:users - 1))::int AS u, NOW() - random() * INTERVAL '30 days' AS t
+        FROM generate_series(1, :posts / 4)
+    ) AS s
+    """,
+    """
+    INSERT INTO story_views (story_id, user_id, viewed_at)
+    SELECT 1 + (random() * (:posts / 4 - 1))::int, 1 + (random() * (:users - 1))::int, NOW()
+    FROM generate_series(1, :posts / 2)
+    """,
+    """
+    INSERT INTO messages (sender_id, receiver_id, content, type, sent_at, read)
+    SELECT s, CASE WHEN r = s THEN 1 + s % :users ELSE r END, 'm', 'text', t, random() < 0.9
+    FROM (
+        SELECT 1 + (random() * (:users - 1))::int AS s, 1 + (random() * 50)::int AS r,
+               NOW() - random() * INTERVAL '365 days' AS t
+        FROM generate_series(1, :messages)
+    ) AS m
+    """,
+    """
+    INSERT INTO timeline_entries (user_id, post_id, author_id, created_at)
+    SELECT f.follower_id, p.id, p.user_id, p.created_at
+    FROM follows AS f JOIN posts AS p ON p.user_id = f.following_id
+    WHERE f.follower_id <= 1000
+    ON CONFLICT DO NOTHING
+    """,
+]
+
+TABLES = [
+    "users", "follows", "posts", "post_comments", "post_views", "reels", "reel_comments",
+    "stories", "story_views", "messages", "timeline_entries",
+]
+
+
+def hot_queries(viewer_id: int, partner_id: int, following: list[int], cursor: tuple):
+    # Built with the same query builders the routers execute, so a change to
+    # a handler's query is checked here without editing this file.
+    return {
+        "posts.get_all_posts": post_page_query(None, cursor, 20),
+        "posts.get_all_posts_exclude_user": post_page_query(viewer_id, cursor, 20),
+        "posts.get_following_feed": timeline_page_query(viewer_id, cursor, 20),
+        "posts.get_following_feed_merged": large_account_posts_query(viewer_id, cursor, 20),
+        "posts.get_comments": post_comments_query(42),
+        "user.get_posts_by_user": user_posts_query(viewer_id),
+        "user.get_followers_by_id": follow_page_query(viewer_id, Follow.following_id, Follow.follower_id, None, 20),
+        "user.get_following_by_id": follow_page_query(viewer_id, Follow.follower_id, Follow.following_id, None, 20),
+        "user.get_followers_by_id_after": follow_page_query(
+            viewer_id, Follow.following_id, Follow.follower_id, (cursor[0], 2 ** 31 - 1), 20
+        ),
+        "user.get_reels_by_user": user_reels_query(viewer_id),
+        "reels.get_reel_comments": reel_comments_query(42),
+        "story.get_following_stories": following_stories_query(following),
+        "story.seen_story_ids": seen_story_ids_query(viewer_id, [1, 2, 3]),
+        "chat.unread_messages": unread_messages_query(viewer_id),
+        "chat.get_messages": message_page_query(viewer_id, partner_id, None, None, 50),
+        "chat.get_messages_before": message_page_query(viewer_id, partner_id, 100000, None, 50),
+        "chat.get_dm_previews": dm_previews_query(viewer_id, None, 20),
+    }
+
+
+def seq_scans(plan: dict) -> list[str]:
+    found = []
+    if plan.get("Node Type") == "Seq Scan" and plan.get("Relation Name") in TABLES:
+        found.append(plan["Relation Name"])
+    for child in plan.get("Plans", []):
+        found += seq_scans(child)
+    return found
+
+
+def main(args) -> int:
+    if not args.database_url:
+        print("Set BENCH_DATABASE_URL or pass --database-url (the database is wiped).")
+        return 2
+    if args.database_url == DATABASE_URL:
+        print("Refusing to run against DATABASE_URL; use a scratch database.")
+        return 2
+
+    engine = create_engine(args.database_url)
+    volume = {
+        "users": 20000 * args.scale,
+        "follows_per_user": 20,
+        "posts": 100000 * args.scale,
+        "messages": 200000 * args.scale,
+    }
+
+    with engine.begin() as conn:
+        conn.execute(text("DROP SCHEMA public CASCADE"))
+        conn.execute(text("CREATE SCHEMA public"))
+        Base.metadata.create_all(conn)
+    with engine.connect() as conn:
+        run_migrations(conn)
+    with engine.begin() as conn:
+        for statement in SEED:
+            conn.execute(text(statement), volume)
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text("ANALYZE"))
+
+    failures = 0
+    cursor = (datetime.now(timezone.utc) - timedelta(days=30), 2 ** 31 - 1)
+    with engine.connect() as conn:
+        following = conn.execute(select(Follow.following_id).where(Follow.follower_id == 7)).scalars().all()
+        queries = hot_queries(viewer_id=7, partner_id=3, following=following, cursor=cursor)
+        for name, stmt in queries.items():
+            compiled = stmt.compile(engine, compile_kwargs={"render_postcompile": True})
+            plan = conn.exec_driver_sql(
+                "EXPLAIN (ANALYZE, FORMAT JSON) " + str(compiled), compiled.params
+            ).scalar()
+            plan = plan if isinstance(plan, list) else json.loads(plan)
+            scans = seq_scans(plan[0]["Plan"])
+            verdict = "SEQ SCAN on " + ", ".join(sorted(set(scans))) if scans else "ok"
+            failures += bool(scans)
+            print(f"{name:32} {plan[0]['Execution Time']:9.2f} ms  {verdict}")
+            if args.verbose:
+                print(json.dumps(plan[0]["Plan"], indent=2))
+
+    engine.dispose()
+    print(f"{failures} of {len(queries)} queries used a sequential scan")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--database-url", default=os.getenv("BENCH_DATABASE_URL"))
+    parser.add_argument("--scale", type=int, default=1)
+    parser.add_argument("--verbose", action="store_true")
+    sys.exit(main(parser.parse_args()))
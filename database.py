@@ -1,14 +1,125 @@
 from sqlalchemy.orm import sessionmaker, DeclarativeBase
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from fastapi import Depends
+from typing import Annotated
 import os
+import time
 from dotenv import load_dotenv
 
 
 load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL")
-engine = create_engine(DATABASE_URL)
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or make_url(DATABASE_URL).set(drivername="postgresql+asyncpg")
+
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 10))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 20))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 10))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", 15000))
+
+POOL_OPTIONS = {
+    "pool_size": DB_POOL_SIZE,
+    "max_overflow": DB_MAX_OVERFLOW,
+    "pool_timeout": DB_POOL_TIMEOUT,
+    "pool_recycle": DB_POOL_RECYCLE,
+    "pool_pre_ping": DB_POOL_PRE_PING,
+}
+
+
+def statement_timeout_args(url) -> dict:
+    if make_url(url).get_driver_name() == "asyncpg":
+        return {"server_settings": {"statement_timeout": str(DB_STATEMENT_TIMEOUT_MS)}}
+    return {"options": f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}"}
+
+
+class PoolStats:
+    def __init__(self):
+        self.pool = None
+        self.checkouts = 0
+        self.timeouts = 0
+        self.connects = 0
+        self.invalidations = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def record_wait(self, seconds: float):
+        self.checkouts += 1
+        self.wait_total += seconds
+        self.wait_max = max(self.wait_max, seconds)
+
+    def snapshot(self) -> dict:
+        return {
+            "pool_size": self.pool.size(),
+            "max_overflow": DB_MAX_OVERFLOW,
+            "checked_out": self.pool.checkedout(),
+            "checked_in": self.pool.checkedin(),
+            "overflow": max(self.pool.overflow(), 0),
+            "checkouts": self.checkouts,
+            "timeouts": self.timeouts,
+            "connects": self.connects,
+            "invalidations": self.invalidations,
+            "wait_avg_ms": round(self.wait_total / self.checkouts * 1000, 3) if self.checkouts else 0.0,
+            "wait_max_ms": round(self.wait_max * 1000, 3),
+        }
+
+
+pool_stats = PoolStats()
+
+
+class TimedPool(AsyncAdaptedQueuePool):
+    # Sessions check a connection out lazily, on their first statement, so
+    # the wait for one is timed here rather than in get_db.
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            connection = super().connect()
+        except PoolTimeoutError:
+            pool_stats.timeouts += 1
+            raise
+        pool_stats.record_wait(time.perf_counter() - start)
+        return connection
+
+
+# Sync engine for one-off scripts (seeder, reconcile_counts); the app itself
+# only talks to the database through the async engine.
+engine = create_engine(DATABASE_URL, connect_args=statement_timeout_args(DATABASE_URL), **POOL_OPTIONS)
 SessionLocal = sessionmaker(bind=engine)
 
+async_engine = create_async_engine(
+    ASYNC_DATABASE_URL, connect_args=statement_timeout_args(ASYNC_DATABASE_URL), poolclass=TimedPool,
+    **POOL_OPTIONS
+)
+AsyncSessionLocal = async_sessionmaker(bind=async_engine, expire_on_commit=False)
+pool_stats.pool = async_engine.sync_engine.pool
+
+
+@event.listens_for(async_engine.sync_engine, "connect")
+def _count_connect(dbapi_connection, connection_record):
+    pool_stats.connects += 1
+
+
+@event.listens_for(async_engine.sync_engine, "invalidate")
+def _count_invalidate(dbapi_connection, connection_record, exception):
+    pool_stats.invalidations += 1
+
+
+async def get_db():
+    # No connection is taken until the request runs its first statement, and
+    # it goes back to the pool at each commit; a pool timeout on the way is
+    # answered with 503 by main.pool_timeout_handler.
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+db_dependency = Annotated[AsyncSession, Depends(get_db)]
+
+
 class Base(DeclarativeBase):
-    pass
\ No newline at end of file
+    pass
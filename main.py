@@ -1,21 +1,57 @@
-from fastapi import FastAPI
-from database import Base, engine
-from routers import user, auth, post, story,chat,reels
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from database import Base, async_engine
+from migrations import run_migrations
+from services.broker import broker
+from services.chat_ingest import ingestor
+from services.derivatives import derivatives
+from services.upload_sessions import janitor
+from services.profiles import profile_cache
+from services.follow_graph import follow_graph
+from services.timeline import trimmer
+from routers import user, auth, post, story,chat,reels, metrics, media, uploads
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    #Base.metadata.drop_all(bind=engine)
-    Base.metadata.create_all(bind=engine, checkfirst=True)
+    async with async_engine.begin() as conn:
+        #await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all, checkfirst=True)
+    async with async_engine.connect() as conn:
+        await conn.run_sync(run_migrations)
+    await broker.start()
+    await follow_graph.start()
+    await ingestor.start()
+    await derivatives.start()
+    await janitor.start()
+    await trimmer.start()
     yield
+    await trimmer.stop()
+    await janitor.stop()
+    await derivatives.stop()
+    await ingestor.stop()
+    await follow_graph.stop()
+    await broker.stop()
+    await profile_cache.stop()
+    await async_engine.dispose()
 
 app = FastAPI(lifespan=lifespan)
 
+
+@app.exception_handler(PoolTimeoutError)
+async def pool_timeout_handler(request: Request, exc: PoolTimeoutError):
+    return JSONResponse(status_code=503, content={"detail": "Database busy, try again"})
+
+
 app.include_router(auth.router, prefix="/api")
 app.include_router(user.router, prefix="/api")
 app.include_router(post.router, prefix="/api")
 app.include_router(story.router, prefix="/api")
 app.include_router(chat.router, prefix="/api")
-app.include_router(reels.router, prefix="/api")
\ No newline at end of file
+app.include_router(reels.router, prefix="/api")
+app.include_router(metrics.router, prefix="/api")
+app.include_router(uploads.router, prefix="/api")
+app.include_router(media.router)
@@ -0,0 +1,122 @@
+import re
+import time
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+from services.counters import RECONCILE_POST_COMMENT_COUNTS, RECONCILE_REEL_COMMENT_COUNTS
+from services.timeline import BACKFILL_TIMELINES
+
+# Applied in order, once per database. create_all() covers fresh databases,
+# so every statement here has to be safe to run against an up-to-date schema.
+# CONCURRENTLY statements run outside any transaction so index builds on the
+# big tables never block writes.
+MIGRATIONS = [
+    ("0001_comment_counts", [
+        "ALTER TABLE posts ADD COLUMN IF NOT EXISTS comment_count INTEGER NOT NULL DEFAULT 0",
+        "ALTER TABLE reels ADD COLUMN IF NOT EXISTS comment_count INTEGER NOT NULL DEFAULT 0",
+        RECONCILE_POST_COMMENT_COUNTS,
+        RECONCILE_REEL_COMMENT_COUNTS,
+    ]),
+    ("0002_timeline_backfill", [
+        BACKFILL_TIMELINES,
+    ]),
+    ("0003_hot_path_indexes", [
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_messages_sender_receiver_sent ON messages (sender_id, receiver_id, sent_at)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_messages_receiver_read ON messages (receiver_id, read)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_post_comments_post_created ON post_comments (post_id, created_at)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_reel_comments_reel_created ON reel_comments (reel_id, created_at)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_stories_user_created ON stories (user_id, created_at)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_stories_expires_at ON stories (expires_at)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_story_views_user_story ON story_views (user_id, story_id)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_follows_following_id ON follows (following_id)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_posts_user_created ON posts (user_id, created_at)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_posts_created_id ON posts (created_at, id)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_post_views_post_id ON post_views (post_id)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_reels_user_created ON reels (user_id, created_at)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_reels_created_at ON reels (created_at)",
+    ]),
+    ("0004_message_pages", [
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_messages_sender_receiver_id ON messages (sender_id, receiver_id, id)",
+    ]),
+    ("0005_follow_pages", [
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_follows_following_followed ON follows (following_id, followed_at, follower_id)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_follows_follower_followed ON follows (follower_id, followed_at, following_id)",
+        # Covered by the leading column of ix_follows_following_followed.
+        "DROP INDEX CONCURRENTLY IF EXISTS ix_follows_following_id",
+    ]),
+    ("0006_rendered_variants", [
+        "ALTER TABLE media_blobs ADD COLUMN IF NOT EXISTS variants INTEGER NOT NULL DEFAULT 0",
+    ]),
+    ("0007_dm_peers", [
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_messages_receiver_sender_id ON messages (receiver_id, sender_id, id)",
+    ]),
+    ("0008_follow_timestamps", [
+        # The follow pages' (followed_at, id) keyset cannot step over NULLs.
+        # Rows of unknown age sort as the oldest.
+        "UPDATE follows SET followed_at = to_timestamp(0) WHERE followed_at IS NULL",
+        "ALTER TABLE follows ALTER COLUMN followed_at SET DEFAULT now()",
+        "ALTER TABLE follows ALTER COLUMN followed_at SET NOT NULL",
+    ]),
+]
+
+MIGRATION_LOCK_ID = 727001
+MIGRATION_LOCK_POLL_SECONDS = 1
+CONCURRENT_INDEX = re.compile(r"CREATE INDEX CONCURRENTLY IF NOT EXISTS (\w+)")
+
+
+def acquire_migration_lock(conn: Connection):
+    # Poll instead of blocking in pg_advisory_lock: a worker parked inside that
+    # statement holds a snapshot, and CREATE INDEX CONCURRENTLY in the worker
+    # holding the lock would wait on it forever.
+    while not conn.execute(text("SELECT pg_try_advisory_lock(:id)"), {"id": MIGRATION_LOCK_ID}).scalar():
+        conn.commit()
+        time.sleep(MIGRATION_LOCK_POLL_SECONDS)
+    conn.commit()
+
+
+def run_concurrently(conn: Connection, statement: str):
+    conn.commit()
+    conn.execution_options(isolation_level="AUTOCOMMIT")
+    try:
+        index = CONCURRENT_INDEX.match(statement)
+        if index:
+            # A failed concurrent build leaves an INVALID index behind that
+            # IF NOT EXISTS would otherwise keep forever.
+            invalid = conn.execute(text(
+                "SELECT 1 FROM pg_index WHERE indexrelid = to_regclass(:name) AND NOT indisvalid"
+            ), {"name": index.group(1)}).scalar()
+            if invalid:
+                conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {index.group(1)}"))
+        conn.execute(text(statement))
+    finally:
+        conn.rollback()
+        conn.execution_options(isolation_level=conn.default_isolation_level)
+
+
+# Takes a connection with no transaction open; commits as it goes.
+def run_migrations(conn: Connection):
+    acquire_migration_lock(conn)
+    try:
+        conn.execute(text(
+            "CREATE TABLE IF NOT EXISTS schema_migrations ("
+            "version VARCHAR PRIMARY KEY, "
+            "applied_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW())"
+        ))
+        applied = set(conn.execute(text("SELECT version FROM schema_migrations")).scalars().all())
+        conn.commit()
+
+        for version, statements in MIGRATIONS:
+            if version in applied:
+                continue
+            for statement in statements:
+                if "CONCURRENTLY" in statement:
+                    run_concurrently(conn, statement)
+                else:
+                    conn.execute(text(statement))
+            conn.execute(text("INSERT INTO schema_migrations (version) VALUES (:version)"), {"version": version})
+            conn.commit()
+    finally:
+        conn.rollback()
+        conn.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": MIGRATION_LOCK_ID})
+        conn.commit()
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, Text, String, DateTime, ForeignKey, UniqueConstraint, text
+from sqlalchemy import Column, Integer, BigInteger, Text, String, DateTime, ForeignKey, UniqueConstraint, Index, text
 from sqlalchemy.orm import relationship, validates
 from sqlalchemy.sql import func
 import datetime
@@ -7,11 +7,16 @@ from database import Base
 
 class Reel(Base):
     __tablename__ = "reels"
+    __table_args__ = (
+        Index("ix_reels_user_created", "user_id", "created_at"),
+        Index("ix_reels_created_at", "created_at"),
+    )
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     description = Column(Text, nullable=True)
     video_url = Column(String, nullable=False)
     like_count = Column(Integer, default=0)
+    comment_count = Column(Integer, default=0, server_default="0", nullable=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
 
@@ -34,6 +39,9 @@ class ReelLike(Base):
 
 class ReelComment(Base):
     __tablename__ = "reel_comments"
+    __table_args__ = (
+        Index("ix_reel_comments_reel_created", "reel_id", "created_at"),
+    )
     id = Column(Integer, primary_key=True)
     reel_id = Column(Integer, ForeignKey("reels.id"), nullable=False)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
@@ -45,6 +53,9 @@ class ReelComment(Base):
 
 class PostComment(Base):
     __tablename__ = "post_comments"
+    __table_args__ = (
+        Index("ix_post_comments_post_created", "post_id", "created_at"),
+    )
 
     id = Column(Integer, primary_key=True)
     post_id = Column(Integer, ForeignKey("posts.id"), nullable=False)
@@ -57,6 +68,12 @@ class PostComment(Base):
 
 class Message(Base):
     __tablename__ = "messages"
+    __table_args__ = (
+        Index("ix_messages_sender_receiver_sent", "sender_id", "receiver_id", "sent_at"),
+        Index("ix_messages_sender_receiver_id", "sender_id", "receiver_id", "id"),
+        Index("ix_messages_receiver_sender_id", "receiver_id", "sender_id", "id"),
+        Index("ix_messages_receiver_read", "receiver_id", "read"),
+    )
     id = Column(Integer, primary_key=True)
     sender_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     receiver_id = Column(Integer, ForeignKey("users.id"), nullable=False)
@@ -70,9 +87,13 @@ class Message(Base):
 
 class Follow(Base):
     __tablename__ = "follows"
+    __table_args__ = (
+        Index("ix_follows_following_followed", "following_id", "followed_at", "follower_id"),
+        Index("ix_follows_follower_followed", "follower_id", "followed_at", "following_id"),
+    )
     follower_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
     following_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
-    followed_at = Column(DateTime(timezone=True), default=func.now())
+    followed_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
     follower = relationship("User", foreign_keys=[follower_id], back_populates="following")
     following = relationship("User", foreign_keys=[following_id], back_populates="followers")
 
@@ -108,7 +129,11 @@ class User(Base):
 
 class Post(Base):
     __tablename__ = "posts"
-    __table_args__ = {'extend_existing': True}
+    __table_args__ = (
+        Index("ix_posts_user_created", "user_id", "created_at"),
+        Index("ix_posts_created_id", "created_at", "id"),
+        {'extend_existing': True},
+    )
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
 
@@ -117,6 +142,7 @@ class Post(Base):
     title = Column(String, nullable=True)
     description = Column(Text, nullable=True)
     like_count = Column(Integer, default=0)
+    comment_count = Column(Integer, default=0, server_default="0", nullable=False)
 
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     
@@ -128,6 +154,18 @@ class Post(Base):
     media = relationship("PostMedia", back_populates="post", cascade="all, delete-orphan")
     post_views = relationship("PostView", back_populates="post", cascade="all, delete-orphan")
 
+class TimelineEntry(Base):
+    __tablename__ = "timeline_entries"
+    __table_args__ = (
+        Index("ix_timeline_entries_user_created", "user_id", "created_at", "post_id"),
+        Index("ix_timeline_entries_post_id", "post_id"),
+        Index("ix_timeline_entries_user_author", "user_id", "author_id"),
+    )
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    post_id = Column(Integer, ForeignKey("posts.id", ondelete="CASCADE"), primary_key=True)
+    author_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    created_at = Column(DateTime(timezone=True), nullable=False)
+
 class PostLike(Base):
     __tablename__ = "post_likes"
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False, primary_key=True)
@@ -139,6 +177,9 @@ class PostLike(Base):
 
 class PostView(Base):
     __tablename__ = "post_views"
+    __table_args__ = (
+        Index("ix_post_views_post_id", "post_id"),
+    )
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     post_id = Column(Integer, ForeignKey("posts.id"), nullable=False)
@@ -170,7 +211,11 @@ class Highlight(Base):
 
 class Story(Base):
     __tablename__ = "stories"
-    __table_args__ = {'extend_existing': True}
+    __table_args__ = (
+        Index("ix_stories_user_created", "user_id", "created_at"),
+        Index("ix_stories_expires_at", "expires_at"),
+        {'extend_existing': True},
+    )
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     song_id = Column(Integer, nullable=True)
@@ -196,10 +241,66 @@ class StoryLike(Base):
 
 class StoryView(Base):
     __tablename__ = "story_views"
+    __table_args__ = (
+        Index("ix_story_views_user_story", "user_id", "story_id"),
+    )
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     story_id = Column(Integer, ForeignKey("stories.id"), nullable=False)
     viewed_at = Column(DateTime(timezone=True), server_default=func.now())
 
     user = relationship("User", back_populates="story_views")
-    story = relationship("Story", back_populates="story_views")
\ No newline at end of file
+    story = relationship("Story", back_populates="story_views")
+
+class MediaBlob(Base):
+    __tablename__ = "media_blobs"
+    __table_args__ = (
+        Index("ix_media_blobs_unreferenced", "updated_at", postgresql_where=text("ref_count = 0")),
+    )
+    sha256 = Column(String(64), primary_key=True)
+    ext = Column(String, nullable=False, default="")
+    content_type = Column(String, nullable=True)
+    size = Column(BigInteger, nullable=False)
+    ref_count = Column(Integer, default=0, server_default="0", nullable=False)
+    # Bitmask of services.derivatives.VARIANT_BITS that have been rendered.
+    variants = Column(Integer, default=0, server_default="0", nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+class UploadSession(Base):
+    __tablename__ = "upload_sessions"
+    __table_args__ = (
+        Index("ix_upload_sessions_expires_at", "expires_at"),
+    )
+    id = Column(String(32), primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    kind = Column(String, nullable=False)
+    filename = Column(String, nullable=False)
+    content_type = Column(String, nullable=False)
+    size = Column(BigInteger, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    expires_at = Column(DateTime(timezone=True), nullable=False)
+
+    chunks = relationship("UploadChunk", cascade="all, delete-orphan", passive_deletes=True)
+
+class UploadChunk(Base):
+    __tablename__ = "upload_chunks"
+    session_id = Column(String(32), ForeignKey("upload_sessions.id", ondelete="CASCADE"), primary_key=True)
+    offset = Column(BigInteger, primary_key=True)
+    length = Column(BigInteger, nullable=False)
+
+class RefreshToken(Base):
+    __tablename__ = "refresh_tokens"
+    __table_args__ = (
+        Index("ix_refresh_tokens_token_hash", "token_hash", unique=True),
+        Index("ix_refresh_tokens_family_id", "family_id"),
+        Index("ix_refresh_tokens_user_expires", "user_id", "expires_at"),
+    )
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    family_id = Column(String(32), nullable=False)
+    token_hash = Column(String(64), nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    expires_at = Column(DateTime(timezone=True), nullable=False)
+    used_at = Column(DateTime(timezone=True), nullable=True)
+    revoked_at = Column(DateTime(timezone=True), nullable=True)
@@ -0,0 +1,15 @@
+from database import SessionLocal
+from services.counters import reconcile_comment_counts
+
+
+if __name__ == "__main__":
+    db = SessionLocal()
+    try:
+        fixed = reconcile_comment_counts(db)
+        db.commit()
+        print(f"Reconciled comment_count on {fixed['posts']} posts and {fixed['reels']} reels")
+    except Exception as e:
+        db.rollback()
+        print("Error reconciling counts:", e)
+    finally:
+        db.close()
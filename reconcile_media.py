@@ -0,0 +1,28 @@
+import argparse
+
+from database import SessionLocal
+from services.media_gc import MediaReconciler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Find (and with --delete remove) media files nothing points at.")
+    parser.add_argument("--delete", action="store_true", help="remove orphans instead of only reporting them")
+    parser.add_argument("--grace-hours", type=float, default=24, help="leave files younger than this alone")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        reconciler = MediaReconciler(db, delete=args.delete, grace=args.grace_hours * 3600, batch_size=args.batch_size)
+        stats = reconciler.run()
+        for key, value in stats.items():
+            print(f"{key:18} {value}")
+        for rel in reconciler.orphan_examples:
+            print("orphan ", rel)
+        for rel in reconciler.missing_examples:
+            print("missing", rel)
+    except Exception as e:
+        db.rollback()
+        print("Error reconciling media:", e)
+    finally:
+        db.close()
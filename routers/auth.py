@@ -1,14 +1,19 @@
 from dotenv import load_dotenv
 from fastapi import APIRouter, Depends, HTTPException
 import os
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import Annotated
-from passlib.context import CryptContext
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from starlette import status
 from models import User
-from database import SessionLocal
-from schemas import Token, CreateUserRequest
+from database import db_dependency
+from schemas import Token, CreateUserRequest, RefreshRequest
+from services.tokens import Principal, token_cache
+from services.passwords import hasher
+from services import refresh_tokens
+from services.refresh_tokens import RefreshTokenError
 from jose import JWTError, jwt
 from datetime import datetime, timedelta
 
@@ -25,47 +30,63 @@ DATABASE_URL = os.getenv("DATABASE_URL")
 ALGORITHM = os.getenv("ALGORITHM")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", 30))
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/auth/token")
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
-db_dependency = Annotated[Session, Depends(get_db)]
 
 @router.post("/", status_code=status.HTTP_201_CREATED)
 async def create_user(db: db_dependency, create_user_request: CreateUserRequest):
-    existing_user = db.query(User).filter(User.username == create_user_request.username).first()
+    existing_user = await db.scalar(select(User).where(User.username == create_user_request.username))
     if existing_user:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="username already registered")
+    # Hand the connection back to the pool while bcrypt runs.
+    await db.commit()
     user_model = User(
         username=create_user_request.username,
-        hashed_password=pwd_context.hash(create_user_request.password[:72]),
+        hashed_password=await hasher.hash(create_user_request.password[:72]),
     )
 
     db.add(user_model)
-    db.commit()
+    try:
+        await db.commit()
+    except IntegrityError:
+        # A concurrent signup took the name while bcrypt ran.
+        await db.rollback()
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="username already registered")
 
 @router.post("/token", response_model=Token)
 async def login_for_token(form_data: Annotated[OAuth2PasswordRequestForm, Depends()], db: db_dependency):
-    user = authenticate_user(form_data.username, form_data.password, db)
+    user = await authenticate_user(form_data.username, form_data.password, db)
     if not user:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Incorrect username or password")
     token = create_access_token(user.username, user.id, timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
-    return {"access_token": token, "token_type": "bearer"}
+    await refresh_tokens.purge_expired(db, user.id)
+    refresh_token = await refresh_tokens.issue(db, user.id)
+    await db.commit()
+    return {"access_token": token, "token_type": "bearer", "refresh_token": refresh_token}
+
+@router.post("/refresh", response_model=Token)
+async def refresh_access_token(db: db_dependency, refresh_request: RefreshRequest):
+    try:
+        user, refresh_token = await refresh_tokens.rotate(db, refresh_request.refresh_token)
+    except RefreshTokenError:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid refresh token")
+    token = create_access_token(user.username, user.id, timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
+    return {"access_token": token, "token_type": "bearer", "refresh_token": refresh_token}
+
+@router.post("/logout", status_code=status.HTTP_204_NO_CONTENT)
+async def logout(db: db_dependency, refresh_request: RefreshRequest):
+    await refresh_tokens.revoke(db, refresh_request.refresh_token)
 
 
 
-def authenticate_user(username: str, password: str, db):
-    user = db.query(User).filter(User.username == username).first()
+async def authenticate_user(username: str, password: str, db: AsyncSession):
+    user = await db.scalar(select(User).where(User.username == username))
 
     if not user:
         return False
-    if not pwd_context.verify(password, user.hashed_password):
+    # Hand the connection back to the pool while bcrypt runs.
+    await db.commit()
+    if not await hasher.verify(password, user.hashed_password):
         return False
 
     return user
@@ -76,13 +97,33 @@ def create_access_token(username: str, user_id: int, expires_delta: timedelta |
     encode.update({"exp": expires})
     return jwt.encode(encode, SECRET_KEY, algorithm=ALGORITHM)
 
-async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)]):
+async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)]) -> Principal:
+    principal = token_cache.get(token)
+    if principal is not None:
+        return principal
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")
         user_id: int = payload.get("id")
         if username is None or user_id is None:
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid authentication credentials")
-        return {"username": username, "id": user_id}
     except JWTError:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid authentication credentials")
\ No newline at end of file
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid authentication credentials")
+
+    principal = Principal(username, user_id)
+    if payload.get("exp") is not None:
+        token_cache.put(token, principal, payload["exp"])
+    return principal
+
+async def get_current_account(user: Annotated[Principal, Depends(get_current_user)], db: db_dependency) -> Principal:
+    # Same session as the handler's db_dependency, so a later db.get(User, ...)
+    # there is answered from the identity map.
+    account = await db.get(User, user["id"])
+    if not account:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid authentication credentials")
+    return Principal(user["username"], user["id"], account)
+
+@router.post("/logout-all", status_code=status.HTTP_204_NO_CONTENT)
+async def logout_all(user: Annotated[Principal, Depends(get_current_user)], db: db_dependency):
+    # Access tokens already handed out stay valid until they expire.
+    await refresh_tokens.revoke_all(db, user["id"])
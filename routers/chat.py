@@ -1,196 +1,268 @@
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends
-from typing import Dict
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends, Query
+from typing import Optional
 from schemas import MessageResponse
-from sqlalchemy import desc, func, or_
-from sqlalchemy.orm import Session
-from database import SessionLocal
+from sqlalchemy import func, select, tuple_, union, union_all, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
+from database import AsyncSessionLocal, get_db
 from models import Message, User
+from services.pagination import encode_cursor, decode_cursor, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from services.broker import broker, user_channel
+from services.outbox import Outbox, OutboxClosed
+from services.chat_ingest import ingestor
 import os
 from dotenv import load_dotenv
 load_dotenv()
 BASE_URL = os.getenv("BASE_URL", "http://56.228.35.186")
+MESSAGE_PAGE_SIZE = 50
 router = APIRouter(tags=["chat"])
-connections: Dict[int, WebSocket] = {}
 
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+def unread_messages_query(user_id: int):
+    return (
+        select(Message)
+        .where(Message.receiver_id == user_id, Message.read == False)
+        .order_by(Message.sent_at, Message.id)
+    )
 
 
 @router.websocket("/ws/{user_id}")
 async def websocket_endpoint(websocket: WebSocket, user_id: int):
     await websocket.accept()
     user_id = int(user_id)
-    connections[user_id] = websocket
 
-    db: Session = SessionLocal()
-    try:
-      
-        unread_msgs = (
-            db.query(Message)
-            .filter(Message.receiver_id == user_id, Message.read == False)
-            .order_by(Message.sent_at)
-            .all()
-        )
+    outbox = Outbox(websocket)
+    outbox.start()
+    channel = user_channel(user_id)
+    await broker.subscribe(channel, outbox.offer)
 
-        for msg in unread_msgs:
-            await websocket.send_json({
-                "id": msg.id,
-                "sender_id": msg.sender_id,
-                "receiver_id": msg.receiver_id,
-                "content": msg.content,
-                "type": msg.type,
-                "sent_at": str(msg.sent_at)
-            })
-            msg.read = True
+    async with AsyncSessionLocal() as db:
+        try:
+      
+            unread_msgs = (await db.scalars(unread_messages_query(user_id))).all()
+            await db.commit()
 
-        db.commit()
+            # Each batch is marked read only once it has been written to the
+            # socket; whatever was not delivered stays unread for the resync.
+            try:
+                async for delivered in outbox.send_batch([
+                    {
+                        "id": msg.id,
+                        "sender_id": msg.sender_id,
+                        "receiver_id": msg.receiver_id,
+                        "content": msg.content,
+                        "type": msg.type,
+                        "sent_at": str(msg.sent_at)
+                    }
+                    for msg in unread_msgs
+                ]):
+                    await db.execute(
+                        update(Message)
+                        .where(Message.id.in_([msg["id"] for msg in delivered]))
+                        .values(read=True)
+                    )
+                    await db.commit()
+            except OutboxClosed:
+                pass
 
     
-        while True:
-            data = await websocket.receive_json()
-            msg_type = data.get("type")
+            while not outbox.closed:
+                data = await websocket.receive_json()
+                msg_type = data.get("type")
 
-            if msg_type == "message":
+                if msg_type == "message":
           
-                try:
-                    new_msg = Message(
-                        sender_id=int(data["sender_id"]),
-                        receiver_id=int(data["receiver_id"]),
-                        content=data["content"],
-                        type=data.get("type", "text"),
-                        read=False
-                    )
-                    db.add(new_msg)
-                    db.commit()
-                    db.refresh(new_msg)
-                except Exception:
-                    db.rollback()
-                    continue
-
-                message_payload = {
-                    "id": new_msg.id,
-                    "sender_id": new_msg.sender_id,
-                    "receiver_id": new_msg.receiver_id,
-                    "content": new_msg.content,
-                    "type": new_msg.type,
-                    "sent_at": str(new_msg.sent_at),
-                    "read": False
-                }
-
-                receiver_ws = connections.get(new_msg.receiver_id)
-                if receiver_ws:
-                    await receiver_ws.send_json(message_payload)
-
-              
-                sender_ws = connections.get(new_msg.sender_id)
-                if sender_ws:
-                    await sender_ws.send_json(message_payload)
-
-            elif msg_type == "read_receipt":
-                try:
-                    msg = db.query(Message).get(data["message_id"])
-                    if msg:
-                        msg.read = True
-                        db.commit()
-
-                        sender_ws = connections.get(msg.sender_id)
-                        if sender_ws:
-                            await sender_ws.send_json({
+                    try:
+                        new_msg = await ingestor.submit(
+                            sender_id=int(data["sender_id"]),
+                            receiver_id=int(data["receiver_id"]),
+                            content=data["content"],
+                            type=data.get("type", "text")
+                        )
+                    except Exception:
+                        continue
+
+                    message_payload = {
+                        "id": new_msg.id,
+                        "sender_id": new_msg.sender_id,
+                        "receiver_id": new_msg.receiver_id,
+                        "content": new_msg.content,
+                        "type": new_msg.type,
+                        "sent_at": str(new_msg.sent_at),
+                        "read": False
+                    }
+
+                    await broker.publish(user_channel(new_msg.receiver_id), message_payload)
+                    if new_msg.sender_id != new_msg.receiver_id:
+                        await broker.publish(user_channel(new_msg.sender_id), message_payload)
+
+                elif msg_type == "read_receipt":
+                    try:
+                        msg = await db.get(Message, data["message_id"])
+                        if msg:
+                            msg.read = True
+                            await db.commit()
+
+                            await broker.publish(user_channel(msg.sender_id), {
                                 "type": "read_receipt",
                                 "message_id": msg.id
                             })
-                except Exception:
-                    db.rollback()
+                    except Exception:
+                        await db.rollback()
 
-    except WebSocketDisconnect:
-        connections.pop(user_id, None)
-        db.close()
+        except WebSocketDisconnect:
+            pass
+        finally:
+            await broker.unsubscribe(channel, outbox.offer)
+            await outbox.stop()
 
-@router.get("/dm_previews/{user_id}")
-def get_dm_previews(user_id: int, db: Session = Depends(get_db)):
-    conv_user_ids = (
-        db.query(Message.sender_id, Message.receiver_id)
-        .filter(or_(Message.sender_id == user_id, Message.receiver_id == user_id))
-        .all()
-    )
+def distinct_peers(name: str, user_id: int, own: str, other: str):
+    # Loose index scan over (own, other, id): each step jumps to the next
+    # distinct peer, so the cost is one index probe per conversation rather
+    # than a read of every message the user has.
+    step = aliased(Message)
 
-    partners = {
-        (r_id if s_id == user_id else s_id)
-        for s_id, r_id in conv_user_ids
-    }
+    def next_peer(after=None):
+        query = select(getattr(step, other)).where(getattr(step, own) == user_id)
+        if after is not None:
+            query = query.where(getattr(step, other) > after)
+        return query.order_by(getattr(step, other)).limit(1)
 
-    previews = []
-    for partner_id in partners:
+    walk = select(next_peer().scalar_subquery().label("partner_id")).cte(name, recursive=True)
+    walk = walk.union_all(select(next_peer(walk.c.partner_id).scalar_subquery()).where(walk.c.partner_id.is_not(None)))
+    return select(walk.c.partner_id).where(walk.c.partner_id.is_not(None))
 
-        partner = db.query(User).filter(User.id == partner_id).first()
 
-        latest_msg = (
-            db.query(Message)
-            .filter(
-                or_(
-                    (Message.sender_id == user_id) & (Message.receiver_id == partner_id),
-                    (Message.sender_id == partner_id) & (Message.receiver_id == user_id),
-                )
-            )
-            .order_by(desc(Message.sent_at))
-            .first()
-        )
+def dm_previews_query(user_id: int, cursor: Optional[tuple], limit: int):
+    # Each conversation's last message is one max(id) probe per direction,
+    # so only the preview rows are read from the table.
+    peers = union(
+        distinct_peers("sent_to", user_id, "sender_id", "receiver_id"),
+        distinct_peers("received_from", user_id, "receiver_id", "sender_id"),
+    ).subquery()
+    probe = aliased(Message)
+    last_id = func.greatest(
+        select(func.max(probe.id))
+        .where(probe.sender_id == user_id, probe.receiver_id == peers.c.partner_id)
+        .scalar_subquery(),
+        select(func.max(probe.id))
+        .where(probe.sender_id == peers.c.partner_id, probe.receiver_id == user_id)
+        .scalar_subquery(),
+    )
+    last = select(peers.c.partner_id, last_id.label("message_id")).subquery()
+    latest = (
+        select(last.c.partner_id, Message.content, Message.sent_at)
+        .join(Message, Message.id == last.c.message_id)
+        .subquery()
+    )
+    unread = (
+        select(Message.sender_id.label("partner_id"), func.count(Message.id).label("unread_count"))
+        .where(Message.receiver_id == user_id, Message.read == False)
+        .group_by(Message.sender_id)
+        .subquery()
+    )
 
-        unread_count = (
-            db.query(func.count(Message.id))
-            .filter(
-                Message.sender_id == partner_id,
-                Message.receiver_id == user_id,
-                Message.read == False
-            )
-            .scalar()
+    page = select(latest)
+    if cursor:
+        page = page.where(tuple_(latest.c.sent_at, latest.c.partner_id) < cursor)
+    # Users and unread counts are joined to the page only, not to every
+    # conversation the user has.
+    page = page.order_by(latest.c.sent_at.desc(), latest.c.partner_id.desc()).limit(limit + 1).subquery()
+
+    return (
+        select(
+            page.c.partner_id,
+            page.c.content,
+            page.c.sent_at,
+            User.username,
+            User.pfp_url,
+            func.coalesce(unread.c.unread_count, 0).label("unread_count")
         )
+        .select_from(page)
+        .outerjoin(User, User.id == page.c.partner_id)
+        .outerjoin(unread, unread.c.partner_id == page.c.partner_id)
+        .order_by(page.c.sent_at.desc(), page.c.partner_id.desc())
+    )
+
 
-        previews.append({
-            "chat_with_id": partner_id,
-            "username": partner.username if partner else None,
-            "pfp_url": partner.pfp_url if partner else None,
+@router.get("/dm_previews/{user_id}")
+async def get_dm_previews(
+    user_id: int,
+    db: AsyncSession = Depends(get_db),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE)
+):
+    rows = (await db.execute(
+        dm_previews_query(user_id, decode_cursor(cursor) if cursor else None, limit)
+    )).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].sent_at, rows[-1].partner_id)
+
+    previews = [
+        {
+            "chat_with_id": row.partner_id,
+            "username": row.username,
+            "pfp_url": row.pfp_url,
             "full_pfp_url": (
-                partner.pfp_url
-                if (partner and partner.pfp_url and partner.pfp_url.startswith("http"))
-                else (f"{BASE_URL}{partner.pfp_url}" if partner and partner.pfp_url else None)
+                row.pfp_url
+                if (row.pfp_url and row.pfp_url.startswith("http"))
+                else (f"{BASE_URL}{row.pfp_url}" if row.pfp_url else None)
             ),
-            "latest_message": latest_msg.content if latest_msg else None,
-            "latest_sent_at": str(latest_msg.sent_at) if latest_msg else None,
-            "unread_count": unread_count
-        })
-    previews.sort(key=lambda x: x["latest_sent_at"] or "", reverse=True)
-    return previews
+            "latest_message": row.content,
+            "latest_sent_at": str(row.sent_at),
+            "unread_count": row.unread_count
+        }
+        for row in rows
+    ]
+    return {"items": previews, "next_cursor": next_cursor}
+
 
 
+def message_page_query(user_id: int, partner_id: int, before: Optional[int], after: Optional[int], limit: int):
+    newest_first = after is None
+
+    def one_direction(sender_id: int, receiver_id: int):
+        query = select(Message.id).where(Message.sender_id == sender_id, Message.receiver_id == receiver_id)
+        if before is not None:
+            query = query.where(Message.id < before)
+        if after is not None:
+            query = query.where(Message.id > after)
+        order = Message.id.desc() if newest_first else Message.id.asc()
+        return select(query.order_by(order).limit(limit).subquery().c.id)
+
+    page_ids = union_all(one_direction(user_id, partner_id), one_direction(partner_id, user_id)).subquery()
+    order = page_ids.c.id.desc() if newest_first else page_ids.c.id.asc()
+    return select(Message).where(Message.id.in_(select(page_ids.c.id).order_by(order).limit(limit)))
+
 
 @router.get("/messages/{user_id}/{partner_id}", response_model=list[MessageResponse])
-def get_messages(user_id: int, partner_id: int, db: Session = Depends(get_db)):
-    messages = (
-        db.query(Message)
-        .filter(
-            or_(
-                (Message.sender_id == user_id) & (Message.receiver_id == partner_id),
-                (Message.sender_id == partner_id) & (Message.receiver_id == user_id),
+async def get_messages(
+    user_id: int,
+    partner_id: int,
+    db: AsyncSession = Depends(get_db),
+    before: Optional[int] = Query(None, description="Only messages with a smaller id"),
+    after: Optional[int] = Query(None, description="Only messages with a larger id"),
+    limit: int = Query(MESSAGE_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE)
+):
+    messages = (await db.scalars(
+        message_page_query(user_id, partner_id, before, after, limit).order_by(Message.id.asc())
+    )).all()
+
+    if messages:
+        result = await db.execute(
+            update(Message)
+            .where(
+                Message.sender_id == partner_id,
+                Message.receiver_id == user_id,
+                Message.read == False,
+                Message.id.between(messages[0].id, messages[-1].id)
             )
+            .values(read=True)
         )
-        .order_by(Message.sent_at.asc())
-        .all()
-    )
-
-  
-    changed = False
-    for msg in messages:
-        if msg.receiver_id == user_id and not msg.read:
-            msg.read = True
-            changed = True
-
-    if changed:
-        db.commit()
+        if result.rowcount:
+            await db.commit()
 
     return messages
@@ -0,0 +1,83 @@
+import asyncio
+import os
+import re
+from email.utils import formatdate, parsedate_to_datetime
+from pathlib import Path
+
+from fastapi import APIRouter, HTTPException, Request, Response
+from fastapi.responses import FileResponse
+from starlette import status
+
+from services.uploads import MEDIA_DIR
+
+router = APIRouter(
+    prefix="/media",
+    tags=["media"]
+)
+
+MEDIA_ROOT = MEDIA_DIR.resolve()
+IMMUTABLE = "public, max-age=31536000, immutable"
+BLOB_RE = re.compile(r"^[0-9a-f]{64}(_\w+)?\.")
+
+
+def resolve_media_path(path: str) -> Path:
+    parts = Path(path).parts
+    if not parts or any(part.startswith(".") for part in parts):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not found")
+    full_path = (MEDIA_ROOT / path).resolve()
+    if not full_path.is_relative_to(MEDIA_ROOT):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not found")
+    return full_path
+
+
+def stat_media(path: Path) -> os.stat_result | None:
+    try:
+        stat_result = os.stat(path)
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+    if not os.path.isfile(path):
+        return None
+    return stat_result
+
+
+def make_etag(path: Path, stat_result: os.stat_result) -> str:
+    # Content-addressed files are named after their hash; everything else was
+    # written once under a random name and never changes in place.
+    if BLOB_RE.match(path.name):
+        return f'"{path.name.split(".", 1)[0]}"'
+    return f'"{stat_result.st_mtime_ns:x}-{stat_result.st_size:x}"'
+
+
+def is_not_modified(request: Request, etag: str, stat_result: os.stat_result) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return etag in tags or "*" in tags
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return int(stat_result.st_mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+@router.api_route("/{path:path}", methods=["GET", "HEAD"])
+async def serve_media(path: str, request: Request):
+    full_path = resolve_media_path(path)
+    stat_result = await asyncio.to_thread(stat_media, full_path)
+    if stat_result is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not found")
+
+    etag = make_etag(full_path, stat_result)
+    headers = {
+        "etag": etag,
+        "last-modified": formatdate(stat_result.st_mtime, usegmt=True),
+        "cache-control": IMMUTABLE,
+        "x-content-type-options": "nosniff",
+    }
+    if is_not_modified(request, etag, stat_result):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    # FileResponse handles HEAD, Range/If-Range and the pathsend extension.
+    return FileResponse(full_path, stat_result=stat_result, headers=headers)
@@ -0,0 +1,45 @@
+from fastapi import APIRouter, Depends, Header, HTTPException
+from typing import Optional
+from starlette import status
+from database import pool_stats
+from services.tokens import token_cache
+from services.passwords import hasher
+from services.profiles import profile_cache
+from services.follow_graph import follow_graph
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+
+def check_metrics_token(x_metrics_token: Optional[str] = Header(None)):
+    if METRICS_TOKEN and x_metrics_token != METRICS_TOKEN:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Invalid metrics token")
+
+
+router = APIRouter(
+    prefix="/metrics",
+    tags=["metrics"],
+    dependencies=[Depends(check_metrics_token)]
+)
+
+
+@router.get("/db")
+async def get_db_metrics():
+    return pool_stats.snapshot()
+
+
+@router.get("/auth")
+async def get_auth_metrics():
+    return {"token_cache": token_cache.snapshot(), "passwords": hasher.snapshot()}
+
+
+@router.get("/profiles")
+async def get_profile_metrics():
+    return profile_cache.snapshot()
+
+
+@router.get("/follow_graph")
+async def get_follow_graph_metrics():
+    return follow_graph.snapshot()
@@ -1,69 +1,81 @@
 from fastapi import APIRouter, Depends, HTTPException, File, UploadFile, Query
 from typing import Annotated, Optional
 from fastapi.params import Form
-from database import SessionLocal
+from database import db_dependency
 from starlette import status
-from sqlalchemy.orm import Session, joinedload
+from sqlalchemy.orm import joinedload
+from sqlalchemy import select, tuple_
 from models import Post, PostLike, User, PostMedia, PostComment
 from routers.auth import get_current_user
-from schemas import PostResponse, PostCommentResponse
-import os
-import uuid
-from pathlib import Path
-from dotenv import load_dotenv
+from schemas import PostResponse, PostCommentResponse, PostPageResponse
+from services.pagination import encode_cursor, decode_cursor, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from services.posts import hydrate_posts, publish_post
+from services.counters import bump_post_comment_count
+from services import timeline
+from services.uploads import save_upload, release_media, remove_media
+from services.derivatives import derivatives
+from services.profiles import profile_cache
 
 router = APIRouter(
     prefix="/posts",
     tags=["posts"]
 )
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
-db_dependency = Annotated[Session, Depends(get_db)]
 user_dependency = Annotated[dict, Depends(get_current_user)]
 
-load_dotenv()
-BASE_DIR = Path(__file__).resolve().parent.parent
-MEDIA_DIR = Path(os.getenv("MEDIA_DIR", "media"))
-MEDIA_DIR = BASE_DIR / MEDIA_DIR
-MEDIA_DIR.mkdir(parents=True, exist_ok=True)
-BASE_URL = os.getenv("BASE_URL", "http://56.228.35.186")
 
-MAX_IMAGE_SIZE = 20 * 1024 * 1024
-MAX_VIDEO_SIZE = 400 * 1024 * 1024
+def post_page_query(exclude_user_id: int | None, after: tuple | None, limit: int):
+    query = select(Post).options(joinedload(Post.user))
+    if exclude_user_id is not None:
+        query = query.where(Post.user_id != exclude_user_id)
+    if after:
+        query = query.where(tuple_(Post.created_at, Post.id) < after)
+    return query.order_by(Post.created_at.desc(), Post.id.desc()).limit(limit + 1)
+
+
+def post_comments_query(post_id: int):
+    return (
+        select(PostComment)
+        .options(joinedload(PostComment.user))
+        .where(PostComment.post_id == post_id)
+        .order_by(PostComment.created_at)
+    )
 
 
-@router.get("/", response_model=list[PostResponse])
+@router.get("/", response_model=PostPageResponse)
 async def get_all_posts(
     db: db_dependency,
     user: user_dependency,
-    exclude_user: bool = Query(False, description="Exclude current user's posts")
+    exclude_user: bool = Query(False, description="Exclude current user's posts"),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE)
 ):
-    query = db.query(Post).options(joinedload(Post.user))
+    posts = (await db.scalars(post_page_query(
+        user["id"] if exclude_user else None, decode_cursor(cursor) if cursor else None, limit
+    ))).all()
 
-    if exclude_user:
-        query = query.filter(Post.user_id != user["id"])
+    next_cursor = None
+    if len(posts) > limit:
+        posts = posts[:limit]
+        next_cursor = encode_cursor(posts[-1].created_at, posts[-1].id)
 
-    query = query.order_by(Post.created_at.desc())
-    posts = query.all()
+    return {"items": await hydrate_posts(db, posts, user["id"]), "next_cursor": next_cursor}
 
-    for post in posts:
-
-        post.has_liked = db.query(PostLike).filter(
-            PostLike.post_id == post.id,
-            PostLike.user_id == user["id"]
-        ).first() is not None
+@router.get("/feed", response_model=PostPageResponse)
+async def get_following_feed(
+    db: db_dependency,
+    user: user_dependency,
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE)
+):
+    posts = await timeline.read_timeline(db, user["id"], decode_cursor(cursor) if cursor else None, limit)
 
-        post.comment_count = db.query(PostComment).filter(
-            PostComment.post_id == post.id
-        ).count()
+    next_cursor = None
+    if len(posts) > limit:
+        posts = posts[:limit]
+        next_cursor = encode_cursor(posts[-1].created_at, posts[-1].id)
 
-    return posts
+    return {"items": await hydrate_posts(db, posts, user["id"]), "next_cursor": next_cursor}
 
 @router.post("/", status_code=status.HTTP_201_CREATED, response_model=PostResponse)
 async def create_post(
@@ -76,98 +88,38 @@ async def create_post(
     if not user:
         raise HTTPException(status_code=401, detail="Not authenticated")
 
-    if not media or not media.filename:
-        raise HTTPException(status_code=400, detail="No media provided")
-
-    allowed_media = [
-        "image/jpeg", "image/png", "image/gif", "video/mp4", "image/webp",
-        "image/avif", "image/svg+xml", "video/quicktime", "image/bmp",
-        "image/tiff", "image/heic"
-    ]
-
-    if media.content_type not in allowed_media:
-        raise HTTPException(status_code=400, detail=f"Unsupported media type: {media.content_type}")
-
-    user_dir = MEDIA_DIR / str(user["id"])
-    user_dir.mkdir(parents=True, exist_ok=True)
-
-    ext = os.path.splitext(media.filename)[1]
-    unique_name = f"{uuid.uuid4().hex}{ext}"
-    file_path = user_dir / unique_name
-
     try:
-        file_size = 0
-        max_size = MAX_VIDEO_SIZE if "video" in media.content_type else MAX_IMAGE_SIZE
-
-        with open(file_path, "wb") as f:
-            while chunk := await media.read(1024 * 1024):
-                file_size += len(chunk)
-                if file_size > max_size:
-                    raise HTTPException(
-                        status_code=400,
-                        detail=f"File too large. Max size: {max_size / (1024 * 1024):.0f}MB"
-                    )
-                f.write(chunk)
-
-        media_url = f"{BASE_URL}/media/{user['id']}/{unique_name}"
-
-        new_post = Post(
-            user_id=user["id"],
-            title=title,
-            description=description,
-            media_url=media_url,
-        )
-        db.add(new_post)
-        db.flush()
-
-        new_post_media = PostMedia(
-            media_url=media_url,
-            post_id=new_post.id,
-        )
-        db.add(new_post_media)
-
-        account = db.query(User).filter(User.id == user["id"]).first()
-        account.posts_count += 1
+        stored = await save_upload(db, media, refs=2)
+        new_post, account = await publish_post(db, user["id"], title, description, stored)
 
-        db.commit()
-        db.refresh(new_post)
+        await db.commit()
+        await profile_cache.invalidate(user["id"])
+        derivatives.schedule(stored, ["thumb", "feed"])
+        await db.refresh(new_post)
+        new_post.user = account
 
         new_post.has_liked = False
-        new_post.comment_count = 0
 
         return new_post
 
     except:
-        if file_path.exists():
-            file_path.unlink()
-        db.rollback()
+        await db.rollback()
         raise
 
 
 
 @router.get("/{post_id}", response_model=PostResponse)
 async def get_post(db: db_dependency, post_id: int, user: user_dependency):
-    post = (
-        db.query(Post)
+    post = await db.scalar(
+        select(Post)
         .options(joinedload(Post.user))
-        .filter(Post.id == post_id)
-        .first()
+        .where(Post.id == post_id)
     )
 
     if not post:
         raise HTTPException(status_code=404, detail="Post not found")
 
-    has_liked = db.query(PostLike).filter(
-        PostLike.post_id == post_id,
-        PostLike.user_id == user["id"]
-    ).first() is not None
-
-    comment_count = db.query(PostComment).filter(
-        PostComment.post_id == post_id
-    ).count()
-
-    post.has_liked = has_liked
-    post.comment_count = comment_count
+    await hydrate_posts(db, [post], user["id"])
 
     return post
 
@@ -175,38 +127,42 @@ async def get_post(db: db_dependency, post_id: int, user: user_dependency):
 
 @router.delete("/{post_id}")
 async def delete_post(db: db_dependency, post_id: int, user: user_dependency):
-    post = db.query(Post).filter(Post.id == post_id, Post.user_id == user["id"]).first()
+    post = await db.scalar(select(Post).where(Post.id == post_id, Post.user_id == user["id"]))
 
     if not post:
         raise HTTPException(status_code=404, detail="Post not found or no permission")
 
-    account = db.query(User).filter(User.id == user["id"]).first()
+    account = await db.get(User, user["id"])
     account.posts_count -= 1
 
-    db.delete(post)
-    db.commit()
+    media_urls = (await db.scalars(select(PostMedia.media_url).where(PostMedia.post_id == post.id))).all()
+    orphaned = [await release_media(db, url) for url in [post.media_url, *media_urls]]
+
+    await timeline.remove_post(db, post.id)
+    await db.delete(post)
+    await db.commit()
+    for url in orphaned:
+        await remove_media(url)
+    await profile_cache.invalidate(user["id"])
 
     return {"detail": "Post deleted successfully"}
 
 
 @router.post("/{post_id}/like", status_code=status.HTTP_202_ACCEPTED)
 async def like_post(db: db_dependency, post_id: int, user: user_dependency):
-    post = db.query(Post).filter(Post.id == post_id).first()
+    post = await db.get(Post, post_id)
 
     if not post:
         raise HTTPException(status_code=404, detail="Post not found")
 
-    existing_like = db.query(PostLike).filter(
-        PostLike.post_id == post_id,
-        PostLike.user_id == user["id"]
-    ).first()
+    existing_like = await db.get(PostLike, (user["id"], post_id))
 
     if existing_like:
         raise HTTPException(status_code=400, detail="Already liked")
 
     post.like_count += 1
     db.add(PostLike(user_id=user["id"], post_id=post_id))
-    db.commit()
+    await db.commit()
 
 
 @router.post("/{post_id}/comment")
@@ -219,7 +175,7 @@ async def comment_post(
     if not user:
         raise HTTPException(status_code=401, detail="Not authenticated")
 
-    post = db.query(Post).filter(Post.id == post_id).first()
+    post = await db.get(Post, post_id)
     if not post:
         raise HTTPException(status_code=404, detail="Post not found")
 
@@ -230,8 +186,9 @@ async def comment_post(
     )
 
     db.add(comment)
-    db.commit()
-    db.refresh(comment)
+    await bump_post_comment_count(db, post_id, 1)
+    await db.commit()
+    await db.refresh(comment)
 
     return {
         "id": comment.id,
@@ -244,13 +201,7 @@ async def comment_post(
 
 @router.get("/{post_id}/comments", response_model=list[PostCommentResponse])
 async def get_comments(post_id: int, db: db_dependency):
-    comments = (
-        db.query(PostComment)
-        .options(joinedload(PostComment.user))
-        .filter(PostComment.post_id == post_id)
-        .order_by(PostComment.created_at)
-        .all()
-    )
+    comments = (await db.scalars(post_comments_query(post_id))).all()
 
     return [
         PostCommentResponse(
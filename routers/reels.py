@@ -1,41 +1,25 @@
-from fastapi import APIRouter, Depends, HTTPException, File, UploadFile
+from fastapi import APIRouter, Depends, HTTPException, File, UploadFile, Query
 from typing import Annotated
 from fastapi.params import Form
-from database import SessionLocal
+from database import db_dependency
 from starlette import status
-from sqlalchemy.orm import Session, joinedload
-from sqlalchemy import select, func
+from sqlalchemy import select
+from sqlalchemy.orm import joinedload
 from models import Reel, ReelLike, ReelComment, User
 from routers.auth import get_current_user
+from services.counters import bump_reel_comment_count
+from services.reels import serialize_reels
+from services import explore
+from services.uploads import save_upload, release_media, remove_media
 from schemas import ReelResponse, ReelListItem, ReelCommentResponse
-import os
-import uuid
-from pathlib import Path
-from dotenv import load_dotenv
 
 router = APIRouter(
     prefix="/reels",
     tags=["reels"]
 )
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
-db_dependency = Annotated[Session, Depends(get_db)]
 user_dependency = Annotated[dict, Depends(get_current_user)]
 
-load_dotenv()
-BASE_DIR = Path(__file__).resolve().parent.parent
-MEDIA_DIR = Path(os.getenv("MEDIA_DIR", "media"))
-MEDIA_DIR = BASE_DIR / MEDIA_DIR
-MEDIA_DIR.mkdir(parents=True, exist_ok=True)
-BASE_URL = os.getenv("BASE_URL", "http://56.228.35.186")
-
-MAX_VIDEO_SIZE = 400 * 1024 * 1024
 ALLOWED_VIDEO_MIME = "video/mp4"
 
 @router.get("/", response_model=list[ReelListItem])
@@ -43,69 +27,26 @@ async def get_all_reels(db: db_dependency, user: user_dependency):
     if not user:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated")
 
-    reels = (
-        db.query(Reel)
+    reels = (await db.scalars(
+        select(Reel)
         .options(joinedload(Reel.user))
         .order_by(Reel.created_at.desc())
-        .all()
-    )
+    )).all()
 
-    counts = (
-        db.query(ReelComment.reel_id, func.count(ReelComment.id))
-        .group_by(ReelComment.reel_id)
-        .all()
-    )
-    comment_map = {r[0]: r[1] for r in counts}
-
-    return [
-        {
-            "id": r.id,
-            "user_id": r.user_id,
-            "description": r.description,
-            "video_url": r.video_url if r.video_url and r.video_url.startswith("http") else (f"{BASE_URL}{r.video_url}" if r.video_url else None),
-            "like_count": r.like_count,
-            "comment_count": comment_map.get(r.id, 0),
-            "created_at": r.created_at,
-            "user": {"id": r.user.id, "username": r.user.username, "pfp_url": r.user.pfp_url},
-            "has_liked": user["id"] in r.like
-        }
-        for r in reels
-    ]
+    return await serialize_reels(db, reels, user["id"])
 
 @router.get("/explore", response_model=list[ReelListItem])
-async def get_explore_reels(db: db_dependency, user: user_dependency, limit: int = 20):
-    results = (
-        db.execute(
-            select(Reel)
-            .options(joinedload(Reel.user))
-            .order_by(func.random())
-            .limit(limit)
-        )
-        .scalars()
-        .all()
-    )
-
-    counts = (
-        db.query(ReelComment.reel_id, func.count(ReelComment.id))
-        .group_by(ReelComment.reel_id)
-        .all()
-    )
-    comment_map = {r[0]: r[1] for r in counts}
+async def get_explore_reels(db: db_dependency, user: user_dependency, limit: int = Query(20, ge=1, le=100)):
+    reel_ids = await explore.sampler.next_ids(db, user["id"], limit)
+    if not reel_ids:
+        return []
+
+    reels = {
+        r.id: r
+        for r in (await db.scalars(select(Reel).options(joinedload(Reel.user)).where(Reel.id.in_(reel_ids)))).all()
+    }
 
-    return [
-        {
-            "id": r.id,
-            "user_id": r.user_id,
-            "description": r.description,
-            "video_url": r.video_url if r.video_url and r.video_url.startswith("http") else (f"{BASE_URL}{r.video_url}" if r.video_url else None),
-            "like_count": r.like_count,
-            "comment_count": comment_map.get(r.id, 0),
-            "created_at": r.created_at,
-            "user": {"id": r.user.id, "username": r.user.username, "pfp_url": r.user.pfp_url},
-            "has_liked": user["id"] in r.like
-        }
-        for r in results
-    ]
+    return await serialize_reels(db, [reels[i] for i in reel_ids if i in reels], user["id"])
 @router.post("/", status_code=status.HTTP_201_CREATED, response_model=ReelResponse)
 async def create_reel(
     db: db_dependency,
@@ -122,23 +63,9 @@ async def create_reel(
     if not (video.content_type and video.content_type.startswith(ALLOWED_VIDEO_MIME)):
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Only MP4 videos allowed. Got: {video.content_type}")
 
-    user_dir = MEDIA_DIR / str(user["id"])
-    user_dir.mkdir(parents=True, exist_ok=True)
-
-    ext = os.path.splitext(video.filename)[1] or ".mp4"
-    unique_name = f"{uuid.uuid4().hex}{ext}"
-    file_path = user_dir / unique_name
-
     try:
-        file_size = 0
-        with open(file_path, "wb") as f:
-            while chunk := await video.read(1024 * 1024):
-                file_size += len(chunk)
-                if file_size > MAX_VIDEO_SIZE:
-                    raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"File too large. Max size: {MAX_VIDEO_SIZE/(1024*1024):.0f}MB")
-                f.write(chunk)
-
-        video_url = f"{BASE_URL}/media/{user['id']}/{unique_name}"
+        stored = await save_upload(db, video, default_ext=".mp4")
+        video_url = stored.url
 
         new_reel = Reel(
             user_id=user["id"],
@@ -147,8 +74,9 @@ async def create_reel(
             like_count=0
         )
         db.add(new_reel)
-        db.commit()
-        db.refresh(new_reel)
+        await db.commit()
+        await db.refresh(new_reel)
+        author = await db.get(User, user["id"])
 
         return {
             "id": new_reel.id,
@@ -158,20 +86,16 @@ async def create_reel(
             "like_count": new_reel.like_count,
             "created_at": new_reel.created_at,
             "updated_at": new_reel.updated_at,
-            "user": {"id": new_reel.user.id, "username": new_reel.user.username, "pfp_url": new_reel.user.pfp_url},
-            "has_liked": user["id"] in new_reel.like
+            "user": {"id": author.id, "username": author.username, "pfp_url": author.pfp_url},
+            "has_liked": False
         }
 
     except HTTPException:
-        if file_path.exists():
-            file_path.unlink()
-        db.rollback()
+        await db.rollback()
         raise
 
     except Exception as e:
-        if file_path.exists():
-            file_path.unlink()
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Error uploading video: {e}")
 
 @router.get("/{reel_id}", response_model=ReelResponse)
@@ -179,10 +103,12 @@ async def get_reel(reel_id: int, db: db_dependency, user: user_dependency):
     if not user:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated")
 
-    reel = db.query(Reel).filter(Reel.id == reel_id).first()
+    reel = await db.scalar(select(Reel).options(joinedload(Reel.user)).where(Reel.id == reel_id))
     if not reel:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Reel not found")
 
+    has_liked = await db.get(ReelLike, (user["id"], reel_id)) is not None
+
     return {
         "id": reel.id,
         "user_id": reel.user_id,
@@ -192,7 +118,7 @@ async def get_reel(reel_id: int, db: db_dependency, user: user_dependency):
         "created_at": reel.created_at,
         "updated_at": reel.updated_at,
         "user": {"id": reel.user.id, "username": reel.user.username, "pfp_url": reel.user.pfp_url},
-        "has_liked": user["id"] in reel.like
+        "has_liked": has_liked
     }
 
 @router.delete("/{reel_id}")
@@ -200,24 +126,17 @@ async def delete_reel(reel_id: int, db: db_dependency, user: user_dependency):
     if not user:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated")
 
-    reel = db.query(Reel).filter(Reel.id == reel_id).first()
+    reel = await db.get(Reel, reel_id)
     if not reel:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Reel not found")
 
     if reel.user_id != user["id"]:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not allowed")
 
-    if reel.video_url:
-        try:
-            path = reel.video_url.replace(f"{BASE_URL}/", "")
-            abs_path = BASE_DIR / path
-            if abs_path.exists():
-                abs_path.unlink()
-        except:
-            pass
-
-    db.delete(reel)
-    db.commit()
+    orphaned = await release_media(db, reel.video_url)
+    await db.delete(reel)
+    await db.commit()
+    await remove_media(orphaned)
     return {"message": "Reel deleted successfully"}
 
 @router.post("/{reel_id}/like")
@@ -225,23 +144,23 @@ async def like_reel(reel_id: int, db: db_dependency, user: user_dependency):
     if not user:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated")
 
-    reel = db.query(Reel).filter(Reel.id == reel_id).first()
+    reel = await db.get(Reel, reel_id)
     if not reel:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Reel not found")
 
-    existing = db.query(ReelLike).filter(ReelLike.reel_id == reel_id, ReelLike.user_id == user["id"]).first()
+    existing = await db.get(ReelLike, (user["id"], reel_id))
     if existing:
-        db.delete(existing)
+        await db.delete(existing)
         if reel.like_count and reel.like_count > 0:
             reel.like_count -= 1
-        db.commit()
+        await db.commit()
         return {"message": "Reel unliked", "like_count": reel.like_count}
     else:
         new_like = ReelLike(user_id=user["id"], reel_id=reel_id)
         db.add(new_like)
         reel.like_count = (reel.like_count or 0) + 1
-        db.commit()
-        db.refresh(reel)
+        await db.commit()
+        await db.refresh(reel)
         return {"message": "Reel liked", "like_count": reel.like_count}
 
 @router.post(
@@ -258,7 +177,7 @@ async def comment_reel(
     if not user:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated")
 
-    reel = db.query(Reel).filter(Reel.id == reel_id).first()
+    reel = await db.get(Reel, reel_id)
     if not reel:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Reel not found")
 
@@ -269,15 +188,15 @@ async def comment_reel(
         content=content
     )
     db.add(comment)
-    db.commit()
-    db.refresh(comment)
+    await bump_reel_comment_count(db, reel_id, 1)
+    await db.commit()
+    await db.refresh(comment)
 
 
-    comment_with_user = (
-        db.query(ReelComment)
+    comment_with_user = await db.scalar(
+        select(ReelComment)
         .options(joinedload(ReelComment.user))
-        .filter(ReelComment.id == comment.id)
-        .first()
+        .where(ReelComment.id == comment.id)
     )
 
     if not comment_with_user or not comment_with_user.user:
@@ -295,9 +214,18 @@ async def comment_reel(
     )
 
 
+def reel_comments_query(reel_id: int):
+    return (
+        select(ReelComment)
+        .options(joinedload(ReelComment.user))
+        .where(ReelComment.reel_id == reel_id)
+        .order_by(ReelComment.created_at)
+    )
+
+
 @router.get("/{reel_id}/comments", response_model=list[ReelCommentResponse])
 async def get_reel_comments(reel_id: int, db: db_dependency):
-    comments = db.query(ReelComment).options(joinedload(ReelComment.user)).filter(ReelComment.reel_id == reel_id).order_by(ReelComment.created_at).all()
+    comments = (await db.scalars(reel_comments_query(reel_id))).all()
     return [
         ReelCommentResponse(
             id=c.id,
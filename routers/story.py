@@ -1,18 +1,16 @@
 from fastapi import APIRouter, Depends, HTTPException, File, UploadFile
 from typing import Annotated, Optional
 from fastapi.params import Form
-from database import SessionLocal
+from database import db_dependency
 from starlette import status
-from sqlalchemy.orm import Session, joinedload
+from sqlalchemy.orm import joinedload
 from sqlalchemy import select
-from sqlalchemy.orm import selectinload
-from models import Story, StoryLike, StoryView, User, Follow
+from models import Story, StoryLike, StoryView, User
 from routers.auth import get_current_user
 from schemas import FeedStoryResponse, StoryResponse
-import os
-import uuid
-from pathlib import Path
-from dotenv import load_dotenv
+from services.uploads import BASE_URL, save_upload, release_media, remove_media
+from services.derivatives import derivatives, load_variants, variants_for
+from services.follow_graph import load_following_ids
 
 router = APIRouter(
     prefix="/stories",
@@ -20,27 +18,11 @@ router = APIRouter(
 )
 
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
-
-db_dependency = Annotated[Session, Depends(get_db)]
 user_dependency = Annotated[dict, Depends(get_current_user)]
 
-load_dotenv()
-BASE_DIR = Path(__file__).resolve().parent.parent
-MEDIA_DIR = Path(os.getenv("MEDIA_DIR", "media"))
-MEDIA_DIR = BASE_DIR / MEDIA_DIR
-MEDIA_DIR.mkdir(parents=True, exist_ok=True)
-BASE_URL = os.getenv("BASE_URL", "http://56.228.35.186")
-
 @router.get("/", response_model=list[StoryResponse])
 async def get_all_stories(db: db_dependency):
-    stories = db.query(Story).options(joinedload(Story.user)).all()
+    stories = (await db.scalars(select(Story).options(joinedload(Story.user)))).all()
     if not stories:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No posts found")
     return stories
@@ -54,27 +36,8 @@ async def create_story(db: db_dependency,
     if not user:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated")
 
-    if not media or not getattr(media, 'filename'):
-        media_url = None
-    if media:
-        if media.content_type not in [
-            "image/jpeg", "image/png", "image/gif", "video/mp4", "image/webp",
-            "image/avif", "image/svg+xml", "video/quicktime", "image/bmp",
-            "image/tiff", "image/heic"
-        ]:
-            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Unsupported media type")
-        MEDIA_DIR.mkdir(parents=True, exist_ok=True)
-        user_dir = MEDIA_DIR / str(user["id"])
-        user_dir.mkdir(parents=True, exist_ok=True)
-        ext = os.path.splitext(media.filename)[1]
-        unique_name = f"{uuid.uuid4().hex}{ext}"
-        file_path = user_dir / unique_name
-
-        with open(file_path, "wb") as f:
-            f.write(await media.read())
-        media_url = f"http://56.228.35.186/media/{user['id']}/{unique_name}"
-    else:
-        media_url = None
+    stored = await save_upload(db, media)
+    media_url = stored.url
 
     new_story = Story(
         user_id=user["id"],
@@ -83,29 +46,36 @@ async def create_story(db: db_dependency,
     )
 
     db.add(new_story)
-    db.commit()
-    db.refresh(new_story)
+    await db.commit()
+    derivatives.schedule(stored, ["thumb", "feed"])
+    await db.refresh(new_story)
     return new_story
 
 
+def following_stories_query(following_ids: list[int]):
+    return (
+        select(Story)
+        .options(joinedload(Story.user))
+        .where(Story.user_id.in_(following_ids))
+        .order_by(Story.created_at.desc())
+    )
+
+
+def seen_story_ids_query(user_id: int, story_ids: list[int]):
+    return select(StoryView.story_id).where(StoryView.story_id.in_(story_ids), StoryView.user_id == user_id)
+
+
 @router.get("/following", response_model=list[FeedStoryResponse])
 async def get_following_stories(db: db_dependency, user: user_dependency):
     if not user:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated")
 
-    following_ids = db.execute(
-        select(Follow.following_id).where(Follow.follower_id == user["id"])
-    ).scalars().all()
+    following_ids = await load_following_ids(db, user["id"])
 
     if not following_ids:
         return []
 
-    stories = db.execute(
-        select(Story)
-        .options(joinedload(Story.user))
-        .where(Story.user_id.in_(following_ids))
-        .order_by(Story.created_at.desc())
-    ).scalars().all()
+    stories = (await db.scalars(following_stories_query(following_ids))).all()
 
     if not stories:
         return []
@@ -113,24 +83,18 @@ async def get_following_stories(db: db_dependency, user: user_dependency):
     story_ids = [story.id for story in stories]
 
     liked_story_ids = set(
-        db.execute(
+        (await db.scalars(
             select(StoryLike.story_id)
             .where(
                 StoryLike.story_id.in_(story_ids),
                 StoryLike.user_id == user["id"]
             )
-        ).scalars().all()
+        )).all()
     )
 
-    seen_story_ids = set(
-        db.execute(
-            select(StoryView.story_id)
-            .where(
-                StoryView.story_id.in_(story_ids),
-                StoryView.user_id == user["id"]
-            )
-        ).scalars().all()
-    )
+    seen_story_ids = set((await db.scalars(seen_story_ids_query(user["id"], story_ids))).all())
+
+    masks = await load_variants(db, [story.media_url for story in stories] + [story.user.pfp_url for story in stories])
 
     story_list = [
         {
@@ -142,8 +106,10 @@ async def get_following_stories(db: db_dependency, user: user_dependency):
             "user": {
                 "id": story.user.id,
                 "username": story.user.username,
-                "pfp_url": story.user.pfp_url
+                "pfp_url": story.user.pfp_url,
+                "pfp_variants": variants_for(masks, story.user.pfp_url),
             },
+            "media_variants": variants_for(masks, story.media_url),
             "has_liked": story.id in liked_story_ids,
             "has_seen": story.id in seen_story_ids
         }
@@ -162,26 +128,23 @@ async def like_story(story_id: int, db: db_dependency, user: user_dependency):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated")
 
 
-    story = db.query(Story).filter(Story.id == story_id).first()
+    story = await db.get(Story, story_id)
     if not story:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Story not found")
 
-    existing_like = db.query(StoryLike).filter(
-        StoryLike.story_id == story_id,
-        StoryLike.user_id == user["id"]
-    ).first()
+    existing_like = await db.get(StoryLike, (user["id"], story_id))
 
     if existing_like:
    
-        db.delete(existing_like)
-        db.commit()
+        await db.delete(existing_like)
+        await db.commit()
         return {"message": "Story unliked"}
     else:
         
         new_like = StoryLike(user_id=user["id"], story_id=story_id)
         db.add(new_like)
-        db.commit()
-        db.refresh(new_like)
+        await db.commit()
+        await db.refresh(new_like)
         return {"message": "Story liked"}
     
 @router.post("/{story_id}/seen")
@@ -190,23 +153,23 @@ async def mark_story_seen(story_id: int, db: db_dependency, user: user_dependenc
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated")
 
     
-    story = db.query(Story).filter(Story.id == story_id).first()
+    story = await db.get(Story, story_id)
     if not story:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Story not found")
 
     
-    existing_view = db.query(StoryView).filter(
+    existing_view = await db.scalar(select(StoryView).where(
         StoryView.story_id == story_id,
         StoryView.user_id == user["id"]
-    ).first()
+    ))
 
     if existing_view:
         return {"message": "Story already seen"}
 
     new_view = StoryView(user_id=user["id"], story_id=story_id)
     db.add(new_view)
-    db.commit()
-    db.refresh(new_view)
+    await db.commit()
+    await db.refresh(new_view)
     return {"message": "Story marked as seen"}
 
 
@@ -215,22 +178,15 @@ async def delete_story(story_id: int, db: db_dependency, user: user_dependency):
     if not user:
         raise HTTPException(status_code=401, detail="Not authenticated")
 
-    story = db.query(Story).filter(Story.id == story_id).first()
+    story = await db.get(Story, story_id)
     if not story:
         raise HTTPException(status_code=404, detail="Story not found")
 
     if story.user_id != user["id"]:
         raise HTTPException(status_code=403, detail="Not allowed")
 
-    if story.media_url:
-        try:
-            path = story.media_url.replace(f"{BASE_URL}/", "")
-            abs_path = BASE_DIR / path
-            if abs_path.exists():
-                abs_path.unlink()
-        except:
-            pass
-
-    db.delete(story)
-    db.commit()
+    orphaned = await release_media(db, story.media_url)
+    await db.delete(story)
+    await db.commit()
+    await remove_media(orphaned)
     return {"message": "Story deleted successfully"}
\ No newline at end of file
@@ -0,0 +1,197 @@
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from typing import Annotated
+from database import db_dependency
+from starlette import status
+from sqlalchemy import func, select
+from sqlalchemy.dialects.postgresql import insert
+from models import Reel, UploadChunk, UploadSession
+from routers.auth import get_current_user
+from routers.reels import ALLOWED_VIDEO_MIME
+from schemas import UploadSessionCreate, UploadSessionResponse, UploadFinalizeRequest, UploadFinalizeResponse
+from services.uploads import ALLOWED_MEDIA, max_size_for, too_large, hash_file, store_blob
+from services.upload_sessions import (
+    UPLOAD_CHUNK_HINT, UPLOAD_MAX_CHUNK, UPLOAD_SESSION_TTL, WRITE_BUFFER,
+    allocate, chunk_path, copy_into, pwrite_all, received_ranges, session_path
+)
+from services.posts import publish_post
+from services.derivatives import derivatives
+from services.profiles import profile_cache
+import asyncio
+import os
+import uuid
+from datetime import datetime, timedelta, timezone
+
+router = APIRouter(
+    prefix="/uploads",
+    tags=["uploads"]
+)
+
+user_dependency = Annotated[dict, Depends(get_current_user)]
+
+
+async def get_upload_session(db, session_id: str, user: dict, lock: bool = False, share: bool = False) -> UploadSession:
+    stmt = select(UploadSession).where(
+        UploadSession.id == session_id,
+        UploadSession.user_id == user["id"],
+        UploadSession.expires_at > func.now(),
+    )
+    if lock:
+        stmt = stmt.with_for_update()
+    elif share:
+        # FOR KEY SHARE: parallel chunk writers don't block each other (nor
+        # their expires_at bumps), but finalize/abort and the janitor, which
+        # delete the row, wait until every in-flight write has committed.
+        stmt = stmt.with_for_update(read=True, key_share=True)
+    upload = await db.scalar(stmt)
+    if not upload:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Upload session not found")
+    return upload
+
+
+async def session_status(db, upload: UploadSession) -> dict:
+    received = await received_ranges(db, upload.id)
+    return {
+        "id": upload.id,
+        "kind": upload.kind,
+        "size": upload.size,
+        "chunk_size": UPLOAD_CHUNK_HINT,
+        "received": received,
+        "complete": received == [[0, upload.size]],
+        "expires_at": upload.expires_at,
+    }
+
+
+@router.post("/", status_code=status.HTTP_201_CREATED, response_model=UploadSessionResponse)
+async def create_upload_session(db: db_dependency, user: user_dependency, body: UploadSessionCreate):
+    if not user:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated")
+
+    if body.content_type not in ALLOWED_MEDIA:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Unsupported media type: {body.content_type}")
+    if body.kind == "reel" and not body.content_type.startswith(ALLOWED_VIDEO_MIME):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Only MP4 videos allowed. Got: {body.content_type}")
+    max_size = max_size_for(body.content_type)
+    if body.size > max_size:
+        raise too_large(max_size)
+
+    upload = UploadSession(
+        id=uuid.uuid4().hex,
+        user_id=user["id"],
+        kind=body.kind,
+        filename=body.filename,
+        content_type=body.content_type,
+        size=body.size,
+        expires_at=datetime.now(timezone.utc) + timedelta(seconds=UPLOAD_SESSION_TTL),
+    )
+    await asyncio.to_thread(allocate, session_path(upload.id), upload.size)
+    db.add(upload)
+    await db.commit()
+    return await session_status(db, upload)
+
+
+@router.get("/{session_id}", response_model=UploadSessionResponse)
+async def get_upload_session_status(session_id: str, db: db_dependency, user: user_dependency):
+    upload = await get_upload_session(db, session_id, user)
+    return await session_status(db, upload)
+
+
+@router.put("/{session_id}", response_model=UploadSessionResponse)
+async def put_upload_chunk(
+    session_id: str,
+    request: Request,
+    db: db_dependency,
+    user: user_dependency,
+    offset: int = Query(..., ge=0)
+):
+    # Chunks may arrive in any order and in parallel. The body is streamed
+    # into a private part file with no transaction open, so a slow client
+    # holds no pooled connection. Only then is the session row share-locked,
+    # the part copied into place with pwrite and the chunk recorded, so
+    # finalize cannot move the file into the content store mid-copy, and a
+    # chunk arriving after finalize finds the session gone.
+    upload = await get_upload_session(db, session_id, user)
+    size = upload.size
+    await db.commit()
+
+    part = chunk_path(session_id)
+    try:
+        length = 0
+        buffer = bytearray()
+        fd = await asyncio.to_thread(os.open, part, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        try:
+            async for piece in request.stream():
+                if offset + length + len(buffer) + len(piece) > size or length + len(buffer) + len(piece) > UPLOAD_MAX_CHUNK:
+                    raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Chunk exceeds the upload size")
+                buffer += piece
+                if len(buffer) >= WRITE_BUFFER:
+                    await asyncio.to_thread(pwrite_all, fd, bytes(buffer), length)
+                    length += len(buffer)
+                    buffer.clear()
+            if buffer:
+                await asyncio.to_thread(pwrite_all, fd, bytes(buffer), length)
+                length += len(buffer)
+        finally:
+            await asyncio.to_thread(os.close, fd)
+
+        if length == 0:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Empty chunk")
+
+        upload = await get_upload_session(db, session_id, user, share=True)
+        fd = await asyncio.to_thread(os.open, session_path(session_id), os.O_WRONLY)
+        try:
+            await asyncio.to_thread(copy_into, part, fd, offset)
+        finally:
+            await asyncio.to_thread(os.close, fd)
+
+        stmt = insert(UploadChunk).values(session_id=session_id, offset=offset, length=length)
+        await db.execute(stmt.on_conflict_do_update(
+            index_elements=[UploadChunk.session_id, UploadChunk.offset],
+            set_={"length": func.greatest(UploadChunk.length, stmt.excluded.length)},
+        ))
+        upload.expires_at = datetime.now(timezone.utc) + timedelta(seconds=UPLOAD_SESSION_TTL)
+        await db.commit()
+    finally:
+        await asyncio.to_thread(part.unlink, missing_ok=True)
+    return await session_status(db, upload)
+
+
+@router.post("/{session_id}/finalize", status_code=status.HTTP_201_CREATED, response_model=UploadFinalizeResponse)
+async def finalize_upload(session_id: str, db: db_dependency, user: user_dependency, body: UploadFinalizeRequest):
+    upload = await get_upload_session(db, session_id, user, lock=True)
+    if await received_ranges(db, session_id) != [[0, upload.size]]:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Upload is incomplete")
+
+    path = session_path(session_id)
+    with await asyncio.to_thread(open, path, "rb") as f:
+        sha256, size = await asyncio.to_thread(hash_file, f, upload.size)
+    ext = os.path.splitext(upload.filename)[1].lower() or (".mp4" if upload.kind == "reel" else "")
+
+    try:
+        if upload.kind == "reel":
+            stored = await store_blob(db, path, sha256, size, ext, upload.content_type)
+            new_item = Reel(user_id=user["id"], description=body.description, video_url=stored.url, like_count=0)
+            db.add(new_item)
+        else:
+            stored = await store_blob(db, path, sha256, size, ext, upload.content_type, refs=2)
+            new_item, _ = await publish_post(db, user["id"], body.title, body.description, stored)
+
+        await db.delete(upload)
+        await db.commit()
+    except:
+        await db.rollback()
+        raise
+
+    await asyncio.to_thread(path.unlink, missing_ok=True)
+    if upload.kind == "post":
+        await profile_cache.invalidate(user["id"])
+        derivatives.schedule(stored, ["thumb", "feed"])
+
+    return {"kind": upload.kind, "id": new_item.id, "media_url": stored.url}
+
+
+@router.delete("/{session_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def abort_upload(session_id: str, db: db_dependency, user: user_dependency):
+    upload = await get_upload_session(db, session_id, user, lock=True)
+    await db.delete(upload)
+    await db.commit()
+    await asyncio.to_thread(session_path(session_id).unlink, missing_ok=True)
@@ -1,144 +1,161 @@
-import os
-from pathlib import Path
-import uuid
-from dotenv import load_dotenv
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File
-from typing import Annotated
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Query, Response
+from typing import Annotated, Optional
+from datetime import datetime
 
-from sqlalchemy.sql.functions import func
-
-from database import SessionLocal
+from database import db_dependency
 from starlette import status
-from sqlalchemy.orm import Session, joinedload
-from models import User, Follow, Post, Reel, ReelComment
-from schemas import UserResponse, FollowResponse, PostResponse, IsFollowingResponse, ReelListItem
-from routers.auth import get_current_user
+from sqlalchemy import select, tuple_
+from sqlalchemy.orm import joinedload
+from models import User, Follow, Post, Reel
+from schemas import UserResponse, FollowResponse, FollowPageResponse, PostResponse, IsFollowingResponse, ReelListItem
+from routers.auth import get_current_user, get_current_account
+from services.tokens import Principal
+from services.pagination import encode_cursor, decode_cursor, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from services.posts import hydrate_posts
+from services import timeline
+from services.reels import serialize_reels
+from services.uploads import save_upload, release_media, remove_media
+from services.derivatives import derivatives, load_variants, variants_for
+from services.profiles import load_profile, profile_cache
+from services.follow_graph import follow_graph, edge_version, follows, followed_among
 
 router = APIRouter(
     prefix="/user",
     tags=["user"]
 )
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
-db_dependency = Annotated[Session, Depends(get_db)]
 user_dependency = Annotated[dict, Depends(get_current_user)]
+account_dependency = Annotated[Principal, Depends(get_current_account)]
 
-load_dotenv()
-MEDIA_DIR = Path(os.getenv("MEDIA_DIR"))
-BASE_URL = os.getenv("BASE_URL", "http://56.228.35.186")
 @router.get("/", response_model=UserResponse)
-async def get_user(db: db_dependency, user: user_dependency):
-    if not user:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated")
-    account = db.query(User).filter(User.id == user["id"]).first()
-    if not account:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
-    return account
+async def get_user(user: user_dependency, db: db_dependency):
+    body = await load_profile(db, user["id"])
+    if body is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid authentication credentials")
+    return Response(content=body, media_type="application/json")
 
 @router.get("/all", response_model=list[UserResponse])
 async def get_all_users(db: db_dependency):
-    users = db.query(User).all()
+    users = (await db.scalars(select(User))).all()
     if not users:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No users found")
     return users
 @router.post("/nickname", response_model=UserResponse)
-async def set_nickname(user: user_dependency, db: db_dependency, new_nickname: str):
-    user = db.query(User).filter(User.id == user["id"]).first()
-    if not user:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User not signed in")
+async def set_nickname(user: account_dependency, db: db_dependency, new_nickname: str):
+    user = user.account
     if len(new_nickname) > 32:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Bio too long")
     user.nickname = new_nickname
-    db.commit()
+    await db.commit()
+    await profile_cache.invalidate(user.id)
     return user
 
 @router.post("/bio", response_model=UserResponse)
-async def set_bio(user: user_dependency, db: db_dependency, new_bio: str):
-    user = db.query(User).filter(User.id == user["id"]).first()
-    if not user:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User not signed in")
+async def set_bio(user: account_dependency, db: db_dependency, new_bio: str):
+    user = user.account
     if len(new_bio) > 255:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Bio too long")
 
     user.bio = new_bio
-    db.commit()
+    await db.commit()
+    await profile_cache.invalidate(user.id)
     return user
 
 @router.post("/pfp_url", response_model=UserResponse)
-async def set_pfp(user: user_dependency, db: db_dependency, media: UploadFile = File(...)):
-    if media.content_type not in [
-        "image/jpeg", "image/png", "image/gif", "video/mp4", "image/webp",
-        "image/avif", "image/svg+xml", "video/quicktime", "image/bmp",
-        "image/tiff", "image/heic"
-    ]:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Unsupported media type")
-    MEDIA_DIR.mkdir(parents=True, exist_ok=True)
-    user_dir = MEDIA_DIR / str(user["id"])
-    user_dir.mkdir(parents=True, exist_ok=True)
-    ext = os.path.splitext(media.filename)[1]
-    unique_name = f"{uuid.uuid4().hex}{ext}"
-    file_path = user_dir / unique_name
-
-    with open(file_path, "wb") as f:
-        f.write(await media.read())
-    media_url = f"{BASE_URL}/media/{user['id']}/{unique_name}"
-
-    db_user = db.query(User).filter(User.id == user["id"]).first()
-    if not db_user:
-        raise HTTPException(status_code=404, detail="User not found")
-
-    db_user.pfp_url = media_url
-    db.commit()
-    db.refresh(db_user)
-    return user
+async def set_pfp(user: account_dependency, db: db_dependency, media: UploadFile = File(...)):
+    db_user = user.account
+
+    stored = await save_upload(db, media)
+    orphaned = await release_media(db, db_user.pfp_url) if db_user.pfp_url else None
+    db_user.pfp_url = stored.url
+    await db.commit()
+    await remove_media(orphaned)
+    await profile_cache.invalidate(db_user.id)
+    derivatives.schedule(stored, ["avatar"])
+    await db.refresh(db_user)
+    return db_user
 
 @router.post("/song_url", response_model=UserResponse)
-async def set_song_id(user: user_dependency, db: db_dependency, new_song: str):
-    if not user:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User not signed in")
-    db_user = db.query(User).filter(User.id == user["id"]).first()
-    if not db_user:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
+async def set_song_id(user: account_dependency, db: db_dependency, new_song: str):
+    db_user = user.account
 
     db_user.song_id = str(new_song)
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
+    await profile_cache.invalidate(db_user.id)
+    await db.refresh(db_user)
     return db_user
 @router.get("/{id}", response_model=UserResponse)
 async def get_user_by_id(id: int, db: db_dependency):
-    account = db.query(User).filter(User.id == id).first()
-    if not account:
+    body = await load_profile(db, id)
+    if body is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
-    return account
-
-@router.get("/{id}/followers", response_model=list[FollowResponse])
-async def get_followers_by_id(id: int, db: db_dependency):
-    followers = db.query(Follow).filter(Follow.following_id == id).all()
-    if not followers:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No followers found for this user")
-    return followers
-
-@router.get("/{id}/following", response_model=list[FollowResponse])
-async def get_following_by_id(id: int, db: db_dependency):
-    following = db.query(Follow).filter(Follow.follower_id == id).all()
-    if not following:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No following found for this user")
-    return following
+    return Response(content=body, media_type="application/json")
+
+def follow_page_query(id: int, column, other_column, after: tuple[datetime, int] | None, limit: int):
+    # column is the side that must equal id; other_column is the listed user.
+    query = (
+        select(Follow.followed_at, User)
+        .join(User, User.id == other_column)
+        .where(column == id)
+    )
+    if after:
+        query = query.where(tuple_(Follow.followed_at, other_column) < after)
+    return query.order_by(Follow.followed_at.desc(), other_column.desc()).limit(limit + 1)
+
+
+async def follow_page(db, query, viewer_id: int, limit: int):
+    rows = (await db.execute(query)).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].followed_at, rows[-1].User.id)
+
+    masks = await load_variants(db, [row.User.pfp_url for row in rows])
+    followed = await followed_among(db, viewer_id, [row.User.id for row in rows])
+    items = [
+        {
+            "id": row.User.id,
+            "username": row.User.username,
+            "pfp_url": row.User.pfp_url,
+            "pfp_variants": variants_for(masks, row.User.pfp_url),
+            "followed_at": row.followed_at,
+            "is_following": row.User.id in followed,
+        }
+        for row in rows
+    ]
+    return {"items": items, "next_cursor": next_cursor}
+
+@router.get("/{id}/followers", response_model=FollowPageResponse)
+async def get_followers_by_id(
+    id: int,
+    db: db_dependency,
+    user: user_dependency,
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE)
+):
+    query = follow_page_query(id, Follow.following_id, Follow.follower_id, decode_cursor(cursor) if cursor else None, limit)
+    return await follow_page(db, query, user["id"], limit)
+
+@router.get("/{id}/following", response_model=FollowPageResponse)
+async def get_following_by_id(
+    id: int,
+    db: db_dependency,
+    user: user_dependency,
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE)
+):
+    query = follow_page_query(id, Follow.follower_id, Follow.following_id, decode_cursor(cursor) if cursor else None, limit)
+    return await follow_page(db, query, user["id"], limit)
 
 @router.post("/{id}/follow", response_model=FollowResponse)
 async def follow(db: db_dependency, id: int, user: user_dependency):
     if not user:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated")
-    account = db.query(User).filter(User.id == id).first()
+    account = await db.get(User, id)
     if not account:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
-    follow = db.query(Follow).filter(Follow.follower_id == user["id"], Follow.following_id == id).first()
+    follow = await db.get(Follow, (user["id"], id))
     if follow:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Already following this user")
     new_follow = Follow(
@@ -146,81 +163,79 @@ async def follow(db: db_dependency, id: int, user: user_dependency):
         following_id=id
     )
     account.followers_count+=1
-    active = db.query(User).filter(User.id == user["id"]).first()
+    active = await db.get(User, user["id"])
     active.following_count += 1
     db.add(new_follow)
-    db.commit()
-    db.refresh(new_follow)
+    await timeline.backfill_author(db, user["id"], account)
+    await db.flush()
+    version = await edge_version(db)
+    await db.commit()
+    await follow_graph.publish("follow", user["id"], id, version)
+    await profile_cache.invalidate(user["id"], id)
+    await db.refresh(new_follow)
     return new_follow
 
 @router.delete("/{id}/follow")
 async def unfollow_user(id: int, db: db_dependency, user: user_dependency):
     if not user:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated")
-    account = db.query(User).filter(User.id == id).first()
+    account = await db.get(User, id)
     if not account:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
-    follow = db.query(Follow).filter(Follow.follower_id == user["id"], Follow.following_id == id).first()
+    follow = await db.get(Follow, (user["id"], id))
     if not follow:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Not following this user")
-    db.delete(follow)
-    active = db.query(User).filter(User.id == user["id"]).first()
+    await db.delete(follow)
+    active = await db.get(User, user["id"])
     active.following_count -= 1
     account.followers_count-=1
-    db.commit()
+    await timeline.remove_author(db, user["id"], id)
+    await db.flush()
+    version = await edge_version(db)
+    await db.commit()
+    await follow_graph.publish("unfollow", user["id"], id, version)
+    await profile_cache.invalidate(user["id"], id)
     return {"message": "Unfollowed successfully"}
 
+def user_posts_query(id: int):
+    return select(Post).options(joinedload(Post.user)).where(Post.user_id == id)
+
+
+def user_reels_query(id: int):
+    return select(Reel).options(joinedload(Reel.user)).where(Reel.user_id == id)
+
+
 @router.get("/{id}/posts", response_model=list[PostResponse])
-async def get_posts_by_user(id: int, db: db_dependency):
-    posts = db.query(Post).options(joinedload(Post.user)).filter(Post.user_id == id).all()
+async def get_posts_by_user(id: int, db: db_dependency, user: user_dependency):
+    posts = (await db.scalars(user_posts_query(id))).all()
     if not posts:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No posts found for this user")
-    return posts
+    return await hydrate_posts(db, posts, user["id"])
 
 
 @router.get("/{id}/is_following", response_model=IsFollowingResponse)
 async def is_following(id: int, db: db_dependency, user: user_dependency):
     if not user:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated")
-    
-    follow = db.query(Follow).filter(
-        Follow.follower_id == user["id"],
-        Follow.following_id == id
-    ).first()
-    
-    return {"is_following": bool(follow)}
+
+    following = await follows(db, user["id"], id)
+    follows_you = await follows(db, id, user["id"])
+    return {
+        "is_following": following,
+        "follows_you": follows_you,
+        "is_mutual": following and follows_you,
+    }
 
 @router.get("/{id}/reels", response_model=list[ReelListItem])
 async def get_reels_by_user(id: int, db: db_dependency, user: user_dependency):
     if not user:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated")
-    account = db.query(User).filter(User.id == id).first()
+    account = await db.get(User, id)
     if not account:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
 
-    reels = db.query(Reel).options(joinedload(Reel.user)).filter(Reel.user_id == id).all()
+    reels = (await db.scalars(user_reels_query(id))).all()
     if not reels:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No reels found for this user")
 
-    counts = (
-        db.query(ReelComment.reel_id, func.count(ReelComment.id))
-        .group_by(ReelComment.reel_id)
-        .all()
-    )
-    comment_map = {r[0]: r[1] for r in counts}
-
-    return [
-        {
-            "id": r.id,
-            "user_id": r.user_id,
-            "description": r.description,
-            "video_url": r.video_url if r.video_url and r.video_url.startswith("http") else (
-                f"{BASE_URL}{r.video_url}" if r.video_url else None),
-            "like_count": r.like_count,
-            "comment_count": comment_map.get(r.id, 0),
-            "created_at": r.created_at,
-            "user": {"id": r.user.id, "username": r.user.username, "pfp_url": r.user.pfp_url},
-            "has_liked": user["id"] in r.like
-        }
-        for r in reels
-    ]
\ No newline at end of file
+    return await serialize_reels(db, reels, user["id"])
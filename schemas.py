@@ -1,9 +1,10 @@
 from datetime import datetime, timedelta
 
 from dotenv import load_dotenv
-from pydantic import BaseModel, ConfigDict, computed_field
-from typing import List, Optional
+from pydantic import BaseModel, ConfigDict, Field, computed_field
+from typing import List, Literal, Optional
 import os
+from services.derivatives import variant_url
 
 load_dotenv()
 BASE_URL = os.getenv("BASE_URL", "http://56.228.35.186")
@@ -12,6 +13,8 @@ class BaseSchema(BaseModel):
     model_config = ConfigDict(from_attributes=True)
 class IsFollowingResponse(BaseModel):
     is_following: bool
+    follows_you: bool = False
+    is_mutual: bool = False
 class PostCommentResponse(BaseModel):
     id: int
     post_id: int
@@ -26,6 +29,10 @@ class PostCommentResponse(BaseModel):
 class Token(BaseModel):
     access_token: str
     token_type: str
+    refresh_token: str | None = None
+
+class RefreshRequest(BaseModel):
+    refresh_token: str
 
 class CreateUserRequest(BaseModel):
     username: str
@@ -68,6 +75,7 @@ class UserShortResponse(BaseModel):
     id: int
     username: str
     pfp_url: Optional[str] = None
+    pfp_variants: int = Field(0, exclude=True)
 
     @computed_field
     @property
@@ -78,10 +86,24 @@ class UserShortResponse(BaseModel):
             return f"{BASE_URL}{self.pfp_url}"
         return None
 
+    @computed_field
+    @property
+    def avatar_url(self) -> str | None:
+        return variant_url(self.pfp_url, "avatar", self.pfp_variants)
+
     class Config:
         from_attributes = True
 
 
+class FollowListItem(UserShortResponse):
+    followed_at: datetime
+    is_following: bool = False
+
+class FollowPageResponse(BaseModel):
+    items: List[FollowListItem]
+    next_cursor: Optional[str] = None
+
+
 class PostResponse(BaseSchema):
     id: int
     user_id: int
@@ -93,6 +115,7 @@ class PostResponse(BaseSchema):
     user: Optional[UserShortResponse] = None
     has_liked: bool = False
     comment_count: int = 0
+    media_variants: int = Field(0, exclude=True)
 
     @computed_field
     @property
@@ -103,6 +126,20 @@ class PostResponse(BaseSchema):
             return f"{BASE_URL}{self.media_url}"
         return None
 
+    @computed_field
+    @property
+    def thumb_url(self) -> str | None:
+        return variant_url(self.media_url, "thumb", self.media_variants)
+
+    @computed_field
+    @property
+    def feed_url(self) -> str | None:
+        return variant_url(self.media_url, "feed", self.media_variants)
+
+class PostPageResponse(BaseModel):
+    items: List[PostResponse]
+    next_cursor: Optional[str] = None
+
 class FeedStoryResponse(BaseSchema):
     id: int
     user_id: int
@@ -112,6 +149,17 @@ class FeedStoryResponse(BaseSchema):
     expires_at: datetime
     has_seen: bool  
     user: Optional[UserShortResponse] = None
+    media_variants: int = Field(0, exclude=True)
+
+    @computed_field
+    @property
+    def thumb_url(self) -> str | None:
+        return variant_url(self.media_url, "thumb", self.media_variants)
+
+    @computed_field
+    @property
+    def feed_url(self) -> str | None:
+        return variant_url(self.media_url, "feed", self.media_variants)
 
 class StoryResponse(BaseModel):
     model_config = ConfigDict(from_attributes=True)
@@ -183,3 +231,27 @@ class MessageResponse(BaseModel):
 
     class Config:
         from_attributes = True
+
+class UploadSessionCreate(BaseModel):
+    kind: Literal["reel", "post"]
+    filename: str
+    content_type: str
+    size: int = Field(gt=0)
+
+class UploadSessionResponse(BaseModel):
+    id: str
+    kind: str
+    size: int
+    chunk_size: int
+    received: List[List[int]]
+    complete: bool
+    expires_at: datetime
+
+class UploadFinalizeRequest(BaseModel):
+    title: Optional[str] = None
+    description: Optional[str] = None
+
+class UploadFinalizeResponse(BaseModel):
+    kind: str
+    id: int
+    media_url: str
@@ -0,0 +1,137 @@
+import asyncio
+import json
+import logging
+import os
+from collections import defaultdict
+from typing import Awaitable, Callable
+
+from dotenv import load_dotenv
+
+load_dotenv()
+CHAT_BROKER_URL = os.getenv("CHAT_BROKER_URL")
+
+logger = logging.getLogger(__name__)
+
+Handler = Callable[[dict], Awaitable[None]]
+
+
+def user_channel(user_id: int) -> str:
+    return f"chat:user:{user_id}"
+
+
+class InProcessBroker:
+    # Only reaches subscribers in this process; fine for a single worker.
+    shared = False
+
+    def __init__(self):
+        self.handlers: dict[str, set[Handler]] = defaultdict(set)
+        self.resets = 0
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        self.handlers.clear()
+
+    async def publish(self, channel: str, payload: dict):
+        await dispatch(self.handlers.get(channel, ()), payload)
+
+    async def subscribe(self, channel: str, handler: Handler):
+        self.handlers[channel].add(handler)
+
+    async def unsubscribe(self, channel: str, handler: Handler):
+        handlers = self.handlers.get(channel)
+        if handlers is not None:
+            handlers.discard(handler)
+            if not handlers:
+                del self.handlers[channel]
+
+
+class RedisBroker:
+    # Works with any redis.asyncio-compatible client (redis-py, fakeredis,
+    # KeyDB, Valkey). Each worker holds one pub/sub connection and only
+    # subscribes to the channels of the sockets connected to it.
+
+    shared = True
+
+    def __init__(self, client):
+        self.client = client
+        self.pubsub = client.pubsub()
+        self.handlers: dict[str, set[Handler]] = defaultdict(set)
+        self.reader: asyncio.Task | None = None
+        # Bumped whenever the connection failed: anything published in the
+        # meantime was lost, so subscribers keeping derived state resync.
+        self.resets = 0
+
+    async def start(self):
+        self.reader = asyncio.create_task(self.read_loop())
+
+    async def stop(self):
+        if self.reader:
+            self.reader.cancel()
+            try:
+                await self.reader
+            except asyncio.CancelledError:
+                pass
+        await self.pubsub.aclose()
+        await self.client.aclose()
+
+    async def publish(self, channel: str, payload: dict):
+        await self.client.publish(channel, json.dumps(payload, default=str))
+
+    async def subscribe(self, channel: str, handler: Handler):
+        if not self.handlers[channel]:
+            await self.pubsub.subscribe(channel)
+        self.handlers[channel].add(handler)
+
+    async def unsubscribe(self, channel: str, handler: Handler):
+        handlers = self.handlers.get(channel)
+        if handlers is None:
+            return
+        handlers.discard(handler)
+        if not handlers:
+            del self.handlers[channel]
+            await self.pubsub.unsubscribe(channel)
+
+    async def read_loop(self):
+        while True:
+            if not self.pubsub.subscribed:
+                await asyncio.sleep(0.05)
+                continue
+            try:
+                message = await self.pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Broker read failed")
+                self.resets += 1
+                await asyncio.sleep(1)
+                continue
+            if message is None:
+                continue
+
+            channel = message["channel"]
+            if isinstance(channel, bytes):
+                channel = channel.decode()
+            await dispatch(self.handlers.get(channel, ()), json.loads(message["data"]))
+
+
+async def dispatch(handlers, payload: dict):
+    for handler in list(handlers):
+        try:
+            await handler(payload)
+        except Exception:
+            logger.exception("Broker handler failed")
+
+
+def create_broker():
+    if not CHAT_BROKER_URL:
+        return InProcessBroker()
+    try:
+        import redis.asyncio as redis
+    except ImportError:
+        raise RuntimeError("CHAT_BROKER_URL is set but the 'redis' package is not installed")
+    return RedisBroker(redis.from_url(CHAT_BROKER_URL))
+
+
+broker = create_broker()
@@ -0,0 +1,130 @@
+import asyncio
+import logging
+import os
+import time
+
+from dotenv import load_dotenv
+from sqlalchemy import insert
+
+from database import AsyncSessionLocal
+from models import Message
+
+load_dotenv()
+CHAT_INGEST_MAX_DELAY_MS = float(os.getenv("CHAT_INGEST_MAX_DELAY_MS", 5))
+CHAT_INGEST_MAX_BATCH = int(os.getenv("CHAT_INGEST_MAX_BATCH", 500))
+
+logger = logging.getLogger(__name__)
+
+
+class MessageIngestor:
+    # Group commit for chat messages: sockets hand their messages to one
+    # writer that inserts everything that arrived within max_delay (or
+    # max_batch rows, whichever comes first) in a single INSERT ... RETURNING.
+    # A single writer flushing batches in arrival order keeps every
+    # conversation in order, and a message never waits longer than max_delay
+    # plus one flush.
+
+    def __init__(self, max_delay_ms: float = CHAT_INGEST_MAX_DELAY_MS, max_batch: int = CHAT_INGEST_MAX_BATCH):
+        self.max_delay = max_delay_ms / 1000
+        self.max_batch = max_batch
+        self.pending: list[tuple[dict, asyncio.Future]] = []
+        self.first_at = 0.0
+        self.arrived = asyncio.Event()
+        self.full = asyncio.Event()
+        self.writer: asyncio.Task | None = None
+        self.stopping = False
+
+    async def start(self):
+        self.stopping = False
+        self.writer = asyncio.create_task(self.run())
+
+    async def stop(self):
+        # The writer is never cancelled: a batch it has already taken may be
+        # mid-INSERT, and its senders are waiting on the result. It drains
+        # what is queued, skipping the delay, and then returns.
+        if self.writer:
+            self.stopping = True
+            self.arrived.set()
+            self.full.set()
+            try:
+                await self.writer
+            except Exception:
+                logger.exception("Message ingestor stopped with an error")
+            self.writer = None
+        batch, self.pending = self.pending, []
+        for _, future in batch:
+            fail(future, RuntimeError("Message ingestor stopped"))
+
+    async def submit(self, sender_id: int, receiver_id: int, content: str, type: str) -> Message:
+        if self.writer is None or self.stopping:
+            raise RuntimeError("Message ingestor is not running")
+        future = asyncio.get_running_loop().create_future()
+        if not self.pending:
+            self.first_at = time.monotonic()
+            self.arrived.set()
+        self.pending.append(({
+            "sender_id": sender_id,
+            "receiver_id": receiver_id,
+            "content": content,
+            "type": type,
+            "read": False,
+        }, future))
+        if len(self.pending) >= self.max_batch:
+            self.full.set()
+        return await future
+
+    async def run(self):
+        while self.pending or not self.stopping:
+            await self.arrived.wait()
+            if not self.pending:
+                # Woken by stop() with nothing queued.
+                self.arrived.clear()
+                continue
+            remaining = self.first_at + self.max_delay - time.monotonic()
+            if remaining > 0 and not self.full.is_set() and not self.stopping:
+                try:
+                    await asyncio.wait_for(self.full.wait(), remaining)
+                except asyncio.TimeoutError:
+                    pass
+            batch, self.pending = self.pending[:self.max_batch], self.pending[self.max_batch:]
+            if self.pending:
+                self.first_at = time.monotonic()
+            else:
+                self.arrived.clear()
+            if len(self.pending) < self.max_batch:
+                self.full.clear()
+            await self.flush(batch)
+
+    async def flush(self, batch: list[tuple[dict, asyncio.Future]]):
+        try:
+            rows = await self.insert([values for values, _ in batch])
+        except Exception:
+            if len(batch) == 1:
+                logger.exception("Failed to store chat message")
+                fail(batch[0][1], RuntimeError("Message could not be stored"))
+                return
+            # One bad row (e.g. an unknown receiver) must not sink the others.
+            for item in batch:
+                await self.flush([item])
+            return
+
+        for (_, future), row in zip(batch, rows):
+            if not future.done():
+                future.set_result(row)
+
+    async def insert(self, values: list[dict]) -> list[Message]:
+        async with AsyncSessionLocal() as db:
+            rows = (await db.scalars(
+                insert(Message).returning(Message, sort_by_parameter_order=True),
+                values
+            )).all()
+            await db.commit()
+            return rows
+
+
+def fail(future: asyncio.Future, exc: Exception):
+    if not future.done():
+        future.set_exception(exc)
+
+
+ingestor = MessageIngestor()
@@ -0,0 +1,43 @@
+from sqlalchemy import text, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from models import Post, Reel
+
+RECONCILE_POST_COMMENT_COUNTS = """
+UPDATE posts AS p
+SET comment_count = COALESCE(c.total, 0)
+FROM posts AS src
+LEFT JOIN (
+    SELECT post_id, COUNT(*) AS total FROM post_comments GROUP BY post_id
+) AS c ON c.post_id = src.id
+WHERE p.id = src.id AND p.comment_count IS DISTINCT FROM COALESCE(c.total, 0)
+"""
+
+RECONCILE_REEL_COMMENT_COUNTS = """
+UPDATE reels AS r
+SET comment_count = COALESCE(c.total, 0)
+FROM reels AS src
+LEFT JOIN (
+    SELECT reel_id, COUNT(*) AS total FROM reel_comments GROUP BY reel_id
+) AS c ON c.reel_id = src.id
+WHERE r.id = src.id AND r.comment_count IS DISTINCT FROM COALESCE(c.total, 0)
+"""
+
+
+async def bump_post_comment_count(db: AsyncSession, post_id: int, delta: int):
+    await db.execute(
+        update(Post).where(Post.id == post_id).values(comment_count=Post.comment_count + delta)
+    )
+
+
+async def bump_reel_comment_count(db: AsyncSession, reel_id: int, delta: int):
+    await db.execute(
+        update(Reel).where(Reel.id == reel_id).values(comment_count=Reel.comment_count + delta)
+    )
+
+
+def reconcile_comment_counts(db: Session) -> dict:
+    posts = db.execute(text(RECONCILE_POST_COMMENT_COUNTS)).rowcount
+    reels = db.execute(text(RECONCILE_REEL_COMMENT_COUNTS)).rowcount
+    return {"posts": posts, "reels": reels}
@@ -0,0 +1,148 @@
+import asyncio
+import logging
+import os
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from dotenv import load_dotenv
+from PIL import Image, ImageOps
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import AsyncSessionLocal
+from models import MediaBlob
+from services.uploads import BASE_URL, CAS_DIR, StoredUpload, blob_sha
+
+load_dotenv()
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", 2))
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", 80))
+
+logger = logging.getLogger(__name__)
+
+# name -> (bounding box, crop to fill it)
+VARIANTS = {
+    "thumb": ((320, 320), True),
+    "feed": ((1080, 1350), False),
+    "avatar": ((150, 150), True),
+}
+VARIANT_BITS = {name: 1 << i for i, name in enumerate(VARIANTS)}
+VARIANT_FORMAT = "webp"
+# Only a cheap filter on what to try; Pillow decides what is really an image.
+DERIVABLE_TYPES = {"image/jpeg", "image/png", "image/webp", "image/gif", "image/bmp", "image/tiff"}
+
+
+def variant_path(sha256: str, variant: str) -> Path:
+    return CAS_DIR / sha256[:2] / f"{sha256}_{variant}.{VARIANT_FORMAT}"
+
+
+def variant_url(media_url: str | None, variant: str, rendered: int) -> str | None:
+    # Variants sit next to their original in the content store. Only those
+    # recorded as rendered on the blob get a URL; for anything else (not
+    # rendered yet, failed, legacy uploads, video) clients keep using the
+    # original.
+    sha256 = blob_sha(media_url)
+    if sha256 is None or not rendered & VARIANT_BITS[variant]:
+        return None
+    return f"{BASE_URL}/media/cas/{sha256[:2]}/{sha256}_{variant}.{VARIANT_FORMAT}"
+
+
+async def load_variants(db: AsyncSession, urls) -> dict[str, int]:
+    # sha256 -> rendered-variant bits for the content-store URLs among urls.
+    shas = {sha256 for sha256 in map(blob_sha, urls) if sha256 is not None}
+    if not shas:
+        return {}
+    rows = (await db.execute(
+        select(MediaBlob.sha256, MediaBlob.variants).where(MediaBlob.sha256.in_(shas))
+    )).all()
+    return {row.sha256: row.variants for row in rows}
+
+
+def variants_for(masks: dict[str, int], url: str | None) -> int:
+    return masks.get(blob_sha(url), 0)
+
+
+async def attach_variants(db: AsyncSession, items: list):
+    # For Post/Story rows about to be serialized: sets media_variants on each
+    # and pfp_variants on its loaded user.
+    users = [item.user for item in items if item.user is not None]
+    masks = await load_variants(db, [item.media_url for item in items] + [user.pfp_url for user in users])
+    for item in items:
+        item.media_variants = variants_for(masks, item.media_url)
+    for user in users:
+        user.pfp_variants = variants_for(masks, user.pfp_url)
+
+
+def render_variants(source: str, sha256: str, variants: list[str]) -> list[str]:
+    # Runs in a worker process. Returns the variants that now exist.
+    pending = [name for name in variants if not variant_path(sha256, name).exists()]
+    if not pending:
+        return variants
+
+    with Image.open(source) as im:
+        largest = max(max(VARIANTS[name][0]) for name in pending)
+        im.draft("RGB", (largest, largest))
+        im = ImageOps.exif_transpose(im)
+        im = im.convert("RGBA" if im.mode in ("RGBA", "LA", "P") else "RGB")
+
+        for name in pending:
+            size, crop = VARIANTS[name]
+            if crop:
+                out = ImageOps.fit(im, size, Image.Resampling.LANCZOS)
+            else:
+                out = im.copy()
+                out.thumbnail(size, Image.Resampling.LANCZOS)
+
+            target = variant_path(sha256, name)
+            temp = target.with_name(f".{target.name}.{uuid.uuid4().hex}.part")
+            try:
+                out.save(temp, VARIANT_FORMAT.upper(), quality=IMAGE_QUALITY, method=4)
+                os.replace(temp, target)
+            except BaseException:
+                temp.unlink(missing_ok=True)
+                raise
+    return variants
+
+
+class DerivativeQueue:
+    def __init__(self, workers: int = IMAGE_WORKERS):
+        self.workers = workers
+        self.pool: ProcessPoolExecutor | None = None
+        self.jobs: set[asyncio.Task] = set()
+
+    async def start(self):
+        self.pool = ProcessPoolExecutor(max_workers=self.workers)
+
+    async def stop(self):
+        if self.jobs:
+            await asyncio.gather(*self.jobs, return_exceptions=True)
+        if self.pool:
+            self.pool.shutdown(cancel_futures=True)
+            self.pool = None
+
+    def schedule(self, stored: StoredUpload, variants: list[str]):
+        if self.pool is None or blob_sha(stored.url) is None or stored.content_type not in DERIVABLE_TYPES:
+            return
+        job = asyncio.create_task(self.run(str(stored.path), stored.sha256, variants))
+        self.jobs.add(job)
+        job.add_done_callback(self.jobs.discard)
+
+    async def run(self, source: str, sha256: str, variants: list[str]):
+        loop = asyncio.get_running_loop()
+        try:
+            rendered = await loop.run_in_executor(self.pool, render_variants, source, sha256, variants)
+            mask = 0
+            for name in rendered:
+                mask |= VARIANT_BITS[name]
+            async with AsyncSessionLocal() as db:
+                await db.execute(
+                    update(MediaBlob)
+                    .where(MediaBlob.sha256 == sha256)
+                    .values(variants=MediaBlob.variants.op("|")(mask))
+                )
+                await db.commit()
+        except Exception:
+            logger.exception("Failed to render %s variants of %s", ",".join(variants), sha256)
+
+
+derivatives = DerivativeQueue()
@@ -0,0 +1,103 @@
+import asyncio
+import math
+import os
+import random
+import time
+from collections import OrderedDict
+
+from dotenv import load_dotenv
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import Reel
+
+load_dotenv()
+EXPLORE_POOL_SIZE = int(os.getenv("EXPLORE_POOL_SIZE", 50000))
+EXPLORE_POOL_TTL = int(os.getenv("EXPLORE_POOL_TTL", 300))
+EXPLORE_SESSION_TTL = int(os.getenv("EXPLORE_SESSION_TTL", 1800))
+EXPLORE_MAX_SESSIONS = int(os.getenv("EXPLORE_MAX_SESSIONS", 10000))
+
+
+class ExploreSession:
+    # Visits pool[(start + n * stride) % len(pool)] for n = 0, 1, ... With
+    # stride coprime to the pool size this is a permutation of the pool,
+    # different for every session, without storing one per user.
+    __slots__ = ("pool", "start", "stride", "served", "touched_at")
+
+    def __init__(self, pool: list[int]):
+        self.pool = pool
+        self.start = random.randrange(len(pool))
+        self.stride = 1
+        if len(pool) > 2:
+            self.stride = random.randrange(1, len(pool))
+            while math.gcd(self.stride, len(pool)) != 1:
+                self.stride = random.randrange(1, len(pool))
+        self.served = 0
+        self.touched_at = time.monotonic()
+
+
+class ExploreSampler:
+    # Each user walks their own order of the pool they started on, so a
+    # session never repeats a reel until it has seen the whole pool, and two
+    # users do not see the same sequence.
+
+    def __init__(self, pool_size: int, pool_ttl: int, session_ttl: int, max_sessions: int):
+        self.pool_size = pool_size
+        self.pool_ttl = pool_ttl
+        self.session_ttl = session_ttl
+        self.max_sessions = max_sessions
+        self.pool: list[int] = []
+        self.refreshed_at = None
+        self.sessions: OrderedDict[int, ExploreSession] = OrderedDict()
+        self.refresh_lock = asyncio.Lock()
+
+    async def refresh(self, db: AsyncSession):
+        ids = list(
+            (await db.scalars(select(Reel.id).order_by(Reel.id.desc()).limit(self.pool_size))).all()
+        )
+        random.shuffle(ids)
+        self.pool = ids
+        self.refreshed_at = time.monotonic()
+
+    def is_stale(self) -> bool:
+        return self.refreshed_at is None or time.monotonic() - self.refreshed_at > self.pool_ttl
+
+    async def ensure_pool(self, db: AsyncSession):
+        if not self.is_stale():
+            return
+        # One request reloads; the rest keep serving the old pool meanwhile
+        # and only wait when there is none yet.
+        if self.refresh_lock.locked() and self.pool:
+            return
+        async with self.refresh_lock:
+            if self.is_stale():
+                await self.refresh(db)
+
+    async def next_ids(self, db: AsyncSession, user_id: int, limit: int) -> list[int]:
+        await self.ensure_pool(db)
+        if not self.pool:
+            return []
+
+        now = time.monotonic()
+        session = self.sessions.pop(user_id, None)
+        if (
+            session is None
+            or now - session.touched_at > self.session_ttl
+            or session.served >= len(session.pool)
+        ):
+            session = ExploreSession(self.pool)
+        self.sessions[user_id] = session
+        while len(self.sessions) > self.max_sessions:
+            self.sessions.popitem(last=False)
+
+        pool = session.pool
+        count = min(limit, len(pool) - session.served)
+        ids = [
+            pool[(session.start + (session.served + i) * session.stride) % len(pool)] for i in range(count)
+        ]
+        session.served += count
+        session.touched_at = now
+        return ids
+
+
+sampler = ExploreSampler(EXPLORE_POOL_SIZE, EXPLORE_POOL_TTL, EXPLORE_SESSION_TTL, EXPLORE_MAX_SESSIONS)
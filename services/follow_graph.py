@@ -0,0 +1,272 @@
+import asyncio
+import logging
+import os
+import sys
+import time
+import uuid
+from array import array
+from bisect import bisect_left
+from typing import Iterable
+
+from dotenv import load_dotenv
+from sqlalchemy import select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import AsyncSessionLocal
+from models import Follow
+from services.broker import broker
+
+load_dotenv()
+FOLLOW_GRAPH_RELOAD_INTERVAL = int(os.getenv("FOLLOW_GRAPH_RELOAD_INTERVAL", 300))
+# With the in-process broker no worker hears about the others' follows,
+# and the worker count cannot be read reliably (uvicorn --workers and
+# gunicorn -w do not export it), so the index is only trusted without a
+# shared broker when the deployment declares it runs a single worker.
+FOLLOW_GRAPH_SINGLE_WORKER = os.getenv("FOLLOW_GRAPH_SINGLE_WORKER", "false").lower() in ("1", "true", "yes")
+
+FOLLOW_EVENTS_CHANNEL = "graph:follows"
+LOAD_BATCH_SIZE = 50000
+CHECK_INTERVAL = 5
+# A write's version is read before its commit, so a transaction stamped
+# shortly before a reload's snapshot may still be missing from it.
+COMMIT_LAG = 30
+
+logger = logging.getLogger(__name__)
+
+EMPTY = array("i")
+
+
+class FollowGraph:
+    # Who each user follows, as a sorted array('i') per follower: 4 bytes per
+    # edge plus one array header per user with any follows, instead of a row
+    # fetch per question. Follow/unfollow apply their change here and publish
+    # it on the broker so other workers apply it too. Every change carries
+    # the database clock at the time its row lock was held, and a change
+    # older than the last one seen for that edge is ignored, so events
+    # delivered out of order cannot undo a newer one. The whole graph is
+    # reloaded every reload_interval, and right away if the broker lost its
+    # connection, which also picks up changes made outside the API.
+
+    def __init__(self, reload_interval: int = FOLLOW_GRAPH_RELOAD_INTERVAL):
+        self.reload_interval = reload_interval
+        self.following: dict[int, array] = {}
+        self.edges = 0
+        self.ready = False
+        self.loaded_at = 0.0
+        self.broker_resets = 0
+        self.reloads = 0
+        # (follower_id, following_id) -> version of the last change applied.
+        # On reload, changes older than floor are taken as part of the
+        # snapshot and their versions dropped.
+        self.versions: dict[tuple[int, int], float] = {}
+        self.floor = 0.0
+        # Events seen while a load is reading rows; replayed once it finishes.
+        self.pending: list[dict] | None = None
+        self.origin = uuid.uuid4().hex
+        self.reloader: asyncio.Task | None = None
+
+    async def start(self):
+        await broker.subscribe(FOLLOW_EVENTS_CHANNEL, self.on_event)
+        await self.load()
+        self.reloader = asyncio.create_task(self.reload_loop())
+
+    async def stop(self):
+        if self.reloader:
+            self.reloader.cancel()
+            try:
+                await self.reloader
+            except asyncio.CancelledError:
+                pass
+            self.reloader = None
+        await broker.unsubscribe(FOLLOW_EVENTS_CHANNEL, self.on_event)
+        self.following.clear()
+        self.versions.clear()
+        self.edges = 0
+        self.ready = False
+
+    def fresh(self) -> bool:
+        # Only then may readers trust the index over the follows table.
+        return (
+            self.ready
+            and (broker.shared or FOLLOW_GRAPH_SINGLE_WORKER)
+            and broker.resets == self.broker_resets
+            and time.time() - self.loaded_at < self.reload_interval + CHECK_INTERVAL * 2
+        )
+
+    async def load(self):
+        self.pending = []
+        resets = broker.resets
+        try:
+            async with AsyncSessionLocal() as db:
+                snapshot_at = await db.scalar(text("SELECT extract(epoch FROM clock_timestamp())"))
+                result = await db.stream(
+                    select(Follow.follower_id, Follow.following_id)
+                    .order_by(Follow.follower_id, Follow.following_id)
+                    .execution_options(yield_per=LOAD_BATCH_SIZE)
+                )
+                following, edges = {}, 0
+                async for rows in result.partitions():
+                    edges += self.extend(following, rows)
+        except BaseException:
+            pending, self.pending = self.pending, None
+            for payload in pending:
+                self.apply(payload)
+            raise
+
+        self.following, self.edges = following, edges
+        self.floor = float(snapshot_at) - COMMIT_LAG
+        self.versions = {edge: version for edge, version in self.versions.items() if version >= self.floor}
+        pending, self.pending = self.pending, None
+        for payload in pending:
+            self.apply(payload)
+        self.loaded_at = time.time()
+        self.broker_resets = resets
+        self.reloads += 1
+        self.ready = True
+        logger.info("Follow graph loaded: %d edges, %d users", self.edges, len(self.following))
+
+    async def reload_loop(self):
+        while True:
+            await asyncio.sleep(CHECK_INTERVAL)
+            if broker.resets == self.broker_resets and time.time() - self.loaded_at < self.reload_interval:
+                continue
+            try:
+                await self.load()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Follow graph reload failed")
+
+    @staticmethod
+    def extend(following: dict[int, array], rows: Iterable[tuple[int, int]]) -> int:
+        # rows must come ordered by (follower_id, following_id).
+        count = 0
+        current_id, current = None, None
+        for follower_id, following_id in rows:
+            if follower_id != current_id:
+                current_id = follower_id
+                current = following.get(follower_id)
+                if current is None:
+                    current = following[follower_id] = array("i")
+            current.append(following_id)
+            count += 1
+        return count
+
+    def add(self, follower_id: int, following_id: int):
+        ids = self.following.get(follower_id)
+        if ids is None:
+            ids = self.following[follower_id] = array("i")
+        i = bisect_left(ids, following_id)
+        if i == len(ids) or ids[i] != following_id:
+            ids.insert(i, following_id)
+            self.edges += 1
+
+    def remove(self, follower_id: int, following_id: int):
+        ids = self.following.get(follower_id)
+        if ids is None:
+            return
+        i = bisect_left(ids, following_id)
+        if i < len(ids) and ids[i] == following_id:
+            del ids[i]
+            self.edges -= 1
+            if not ids:
+                del self.following[follower_id]
+
+    def is_following(self, follower_id: int, following_id: int) -> bool:
+        ids = self.following.get(follower_id, EMPTY)
+        i = bisect_left(ids, following_id)
+        return i < len(ids) and ids[i] == following_id
+
+    def is_mutual(self, user_id: int, other_id: int) -> bool:
+        return self.is_following(user_id, other_id) and self.is_following(other_id, user_id)
+
+    def following_ids(self, follower_id: int) -> array:
+        return self.following.get(follower_id, EMPTY)
+
+    def apply(self, payload: dict):
+        edge = (payload["follower_id"], payload["following_id"])
+        version = payload["version"]
+        if version < self.floor or version <= self.versions.get(edge, 0.0):
+            return
+        self.versions[edge] = version
+        if payload["op"] == "follow":
+            self.add(*edge)
+        elif payload["op"] == "unfollow":
+            self.remove(*edge)
+
+    async def on_event(self, payload: dict):
+        if payload.get("origin") == self.origin:
+            return
+        if self.pending is not None:
+            self.pending.append(payload)
+        else:
+            self.apply(payload)
+
+    async def publish(self, op: str, follower_id: int, following_id: int, version: float):
+        # Applied locally first so this worker's next request already sees
+        # it. The broker delivers our own events back to us; those are
+        # skipped.
+        payload = {"op": op, "follower_id": follower_id, "following_id": following_id, "version": version}
+        if self.pending is not None:
+            self.pending.append(payload)
+        else:
+            self.apply(payload)
+        await broker.publish(FOLLOW_EVENTS_CHANNEL, {**payload, "origin": self.origin})
+
+    def memory_bytes(self) -> int:
+        # Small ints are shared, so keys are counted as full int objects to
+        # stay on the safe side.
+        total = sys.getsizeof(self.following)
+        for ids in self.following.values():
+            total += sys.getsizeof(ids) + 28
+        total += sys.getsizeof(self.versions)
+        for edge, version in self.versions.items():
+            total += sys.getsizeof(edge) + 2 * 28 + sys.getsizeof(version)
+        return total
+
+    def snapshot(self) -> dict:
+        size = self.memory_bytes()
+        return {
+            "ready": self.ready,
+            "fresh": self.fresh(),
+            "loaded_seconds_ago": round(time.time() - self.loaded_at, 1) if self.ready else None,
+            "reloads": self.reloads,
+            "users": len(self.following),
+            "edges": self.edges,
+            "tracked_versions": len(self.versions),
+            "bytes": size,
+            "bytes_per_edge": round(size / self.edges, 2) if self.edges else None,
+            "mb_per_million_edges": round(size / self.edges * 1e6 / 2**20, 2) if self.edges else None,
+        }
+
+
+follow_graph = FollowGraph()
+
+
+async def edge_version(db: AsyncSession) -> float:
+    # Call after the follow row has been inserted or deleted (flushed) and
+    # before commit: the row lock orders conflicting writers, so a later
+    # change of the same edge always reads a later clock.
+    return float(await db.scalar(text("SELECT extract(epoch FROM clock_timestamp())")))
+
+
+async def follows(db: AsyncSession, follower_id: int, following_id: int) -> bool:
+    if follow_graph.fresh():
+        return follow_graph.is_following(follower_id, following_id)
+    return await db.get(Follow, (follower_id, following_id)) is not None
+
+
+async def followed_among(db: AsyncSession, follower_id: int, ids: list[int]) -> set[int]:
+    if not ids:
+        return set()
+    if follow_graph.fresh():
+        return {i for i in ids if follow_graph.is_following(follower_id, i)}
+    return set((await db.scalars(
+        select(Follow.following_id).where(Follow.follower_id == follower_id, Follow.following_id.in_(ids))
+    )).all())
+
+
+async def load_following_ids(db: AsyncSession, follower_id: int) -> list[int]:
+    if follow_graph.fresh():
+        return follow_graph.following_ids(follower_id).tolist()
+    return list((await db.scalars(select(Follow.following_id).where(Follow.follower_id == follower_id))).all())
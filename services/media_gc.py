@@ -0,0 +1,245 @@
+import os
+import re
+import time
+from typing import Iterator
+
+from sqlalchemy import bindparam, text
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+
+from services.uploads import MEDIA_DIR
+
+# Every stored media URL, reduced to its path under MEDIA_DIR and sorted
+# bytewise so it can be merged against a sorted walk of the directory.
+MEDIA_REFERENCES = """
+SELECT rel FROM (
+    SELECT substring(media_url from '/media/(.+)$') AS rel FROM posts
+    UNION ALL SELECT substring(media_url from '/media/(.+)$') FROM post_media
+    UNION ALL SELECT substring(media_url from '/media/(.+)$') FROM stories
+    UNION ALL SELECT substring(video_url from '/media/(.+)$') FROM reels
+    UNION ALL SELECT substring(pfp_url from '/media/(.+)$') FROM users
+) AS refs
+WHERE rel IS NOT NULL
+ORDER BY rel COLLATE "C"
+"""
+
+# Rows touched within the grace period are skipped: their referencing rows
+# may not be committed yet.
+RECOUNT_MEDIA_BLOBS = """
+UPDATE media_blobs AS b
+SET ref_count = COALESCE(c.total, 0)
+FROM media_blobs AS src
+LEFT JOIN (
+    SELECT substring(url from '/media/cas/[0-9a-f]{2}/([0-9a-f]{64})') AS sha256, COUNT(*) AS total
+    FROM (
+        SELECT media_url AS url FROM posts
+        UNION ALL SELECT media_url FROM post_media
+        UNION ALL SELECT media_url FROM stories
+        UNION ALL SELECT video_url FROM reels
+        UNION ALL SELECT pfp_url FROM users
+    ) AS refs
+    GROUP BY 1
+) AS c ON c.sha256 = src.sha256
+WHERE b.sha256 = src.sha256
+  AND b.updated_at < NOW() - make_interval(secs => :grace)
+  AND b.ref_count IS DISTINCT FROM COALESCE(c.total, 0)
+"""
+
+DELETE_UNREFERENCED_BLOBS = """
+DELETE FROM media_blobs
+WHERE ref_count = 0 AND updated_at < NOW() - make_interval(secs => :grace)
+"""
+
+CAS_FILE_RE = re.compile(r"^cas/[0-9a-f]{2}/([0-9a-f]{64})")
+# Owned by services.upload_sessions, which expires them itself.
+SKIP_DIRS = {".uploads"}
+MAX_EXAMPLES = 20
+
+
+def walk_media(root=MEDIA_DIR, prefix: str = "") -> Iterator[tuple[str, os.DirEntry]]:
+    # Yields (relative path, entry) in the same bytewise order as the query:
+    # a directory sorts as "name/" so "a/b" comes after "a-c".
+    with os.scandir(root) as it:
+        entries = sorted(it, key=lambda e: e.name + "/" if e.is_dir(follow_symlinks=False) else e.name)
+    for entry in entries:
+        rel = prefix + entry.name
+        if entry.is_dir(follow_symlinks=False):
+            if rel not in SKIP_DIRS:
+                yield from walk_media(entry.path, rel + "/")
+        elif entry.is_file(follow_symlinks=False):
+            yield rel, entry
+
+
+def stream_references(conn: Connection, batch_size: int) -> Iterator[str]:
+    result = conn.execute(text(MEDIA_REFERENCES).execution_options(stream_results=True, yield_per=batch_size))
+    for row in result:
+        yield row.rel
+
+
+class MediaReconciler:
+    # One merge pass over MEDIA_DIR and the media URL columns. Files that no
+    # row points at and that are older than the grace period are orphans;
+    # content-store files are only removed once their media_blobs row can be
+    # dropped (ref_count 0, untouched for the grace period). URLs whose file
+    # is gone are reported.
+
+    def __init__(self, db: Session, delete: bool = False, grace: float = 24 * 3600, batch_size: int = 1000):
+        self.db = db
+        self.delete = delete
+        self.grace = grace
+        self.batch_size = batch_size
+        self.cutoff = time.time() - grace
+        self.pending: list[tuple[str, str | None, os.DirEntry]] = []
+        self.stats = {
+            "files": 0, "referenced": 0, "recent": 0, "orphans": 0, "orphan_bytes": 0,
+            "protected": 0, "deleted": 0, "missing": 0, "blob_rows_deleted": 0, "recounted": 0,
+        }
+        self.orphan_examples: list[str] = []
+        self.missing_examples: list[str] = []
+
+    def run(self) -> dict:
+        if self.delete:
+            self.stats["recounted"] = self.db.execute(text(RECOUNT_MEDIA_BLOBS), {"grace": self.grace}).rowcount
+            self.db.commit()
+
+        # The reference cursor gets its own connection so that committing
+        # batches on the session does not close it.
+        with self.db.get_bind().connect() as conn:
+            self.merge(stream_references(conn, self.batch_size))
+
+        self.flush()
+        if self.delete:
+            self.stats["blob_rows_deleted"] += self.db.execute(
+                text(DELETE_UNREFERENCED_BLOBS), {"grace": self.grace}
+            ).rowcount
+            self.db.commit()
+        return self.stats
+
+    def merge(self, refs: Iterator[str]):
+        ref = next(refs, None)
+        seen = None
+        kept_sha = None
+
+        for rel, entry in walk_media():
+            self.stats["files"] += 1
+            while ref is not None and ref < rel:
+                if ref != seen:
+                    self.note_missing(ref)
+                    seen = ref
+                kept_sha = self.cas_sha(ref) or kept_sha
+                ref = next(refs, None)
+
+            sha = self.cas_sha(rel)
+            if ref == rel:
+                seen = rel
+                kept_sha = sha or kept_sha
+                self.stats["referenced"] += 1
+            elif sha is not None and sha == kept_sha:
+                # A rendered variant of a referenced original.
+                self.stats["referenced"] += 1
+            elif entry.stat().st_mtime >= self.cutoff:
+                self.stats["recent"] += 1
+            else:
+                self.pending.append((rel, sha, entry))
+                if len(self.pending) >= self.batch_size:
+                    self.flush()
+
+        while ref is not None:
+            if ref != seen:
+                self.note_missing(ref)
+                seen = ref
+            ref = next(refs, None)
+
+    @staticmethod
+    def cas_sha(rel: str) -> str | None:
+        match = CAS_FILE_RE.match(rel)
+        return match.group(1) if match else None
+
+    def note_missing(self, rel: str):
+        self.stats["missing"] += 1
+        if len(self.missing_examples) < MAX_EXAMPLES:
+            self.missing_examples.append(rel)
+
+    def flush(self):
+        if not self.pending:
+            return
+        batch, self.pending = self.pending, []
+
+        shas = sorted({sha for _, sha, _ in batch if sha is not None})
+        if self.delete:
+            doomed = self.lock_unreferenced(shas)
+        else:
+            doomed = set(shas) - self.protected_shas(shas)
+
+        removed_shas = set(doomed)
+        for rel, sha, entry in batch:
+            if sha is not None and sha not in doomed:
+                self.stats["protected"] += 1
+                continue
+            self.stats["orphans"] += 1
+            self.stats["orphan_bytes"] += entry.stat().st_size
+            if len(self.orphan_examples) < MAX_EXAMPLES:
+                self.orphan_examples.append(rel)
+            if self.delete:
+                try:
+                    os.unlink(entry.path)
+                    self.stats["deleted"] += 1
+                except FileNotFoundError:
+                    pass
+                except OSError:
+                    removed_shas.discard(sha)
+
+        if self.delete:
+            # Only now, with the files gone, do the rows (still locked by
+            # lock_unreferenced) go away and let waiting uploads through.
+            if removed_shas:
+                self.stats["blob_rows_deleted"] += self.db.execute(
+                    text("DELETE FROM media_blobs WHERE sha256 IN :shas").bindparams(
+                        bindparam("shas", expanding=True)
+                    ),
+                    {"shas": sorted(removed_shas)},
+                ).rowcount
+            self.db.commit()
+
+    def protected_shas(self, shas: list[str]) -> set[str]:
+        # Blob rows still counted or recently touched keep their files.
+        if not shas:
+            return set()
+        protected = set(self.db.scalars(
+            text(
+                "SELECT sha256 FROM media_blobs WHERE sha256 IN :shas "
+                "AND (ref_count > 0 OR updated_at >= NOW() - make_interval(secs => :grace))"
+            ).bindparams(bindparam("shas", expanding=True)),
+            {"shas": shas, "grace": self.grace},
+        ).all())
+        self.db.commit()
+        return protected
+
+    def lock_unreferenced(self, shas: list[str]) -> set[str]:
+        # Returns the content hashes whose files may be removed, with their
+        # media_blobs rows locked until flush commits. An upload of the same
+        # content blocks in acquire_blob on that lock, so it cannot see the
+        # file as present and skip writing it just before the unlink; once
+        # the row is deleted it inserts a fresh one and writes the file anew.
+        # Rows an upload is already incrementing are skipped, not waited on.
+        if not shas:
+            return set()
+        locked = set(self.db.scalars(
+            text(
+                "SELECT sha256 FROM media_blobs WHERE sha256 IN :shas AND ref_count = 0 "
+                "AND updated_at < NOW() - make_interval(secs => :grace) "
+                "FOR UPDATE SKIP LOCKED"
+            ).bindparams(bindparam("shas", expanding=True)),
+            {"shas": shas, "grace": self.grace},
+        ).all())
+        # Files with no row at all get a placeholder row for the same
+        # purpose; it is deleted again before the transaction commits.
+        locked |= set(self.db.scalars(
+            text(
+                "INSERT INTO media_blobs (sha256, ext, size, ref_count) "
+                "SELECT sha, '', 0, 0 FROM unnest(CAST(:shas AS VARCHAR[])) AS sha "
+                "ON CONFLICT (sha256) DO NOTHING RETURNING sha256"
+            ),
+            {"shas": shas},
+        ).all())
+        return locked
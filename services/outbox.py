@@ -0,0 +1,118 @@
+import asyncio
+import logging
+import os
+
+from dotenv import load_dotenv
+from fastapi import WebSocket
+
+load_dotenv()
+CHAT_SEND_QUEUE_SIZE = int(os.getenv("CHAT_SEND_QUEUE_SIZE", 256))
+CHAT_BATCH_SIZE = int(os.getenv("CHAT_BATCH_SIZE", 100))
+# "disconnect" closes a socket that cannot keep up so the client reconnects
+# and replays its unread backlog; "drop" discards the frames it missed.
+CHAT_OVERFLOW_POLICY = os.getenv("CHAT_OVERFLOW_POLICY", "disconnect")
+RESYNC_CLOSE_CODE = 1013
+
+logger = logging.getLogger(__name__)
+
+CLOSE = object()
+
+
+class OutboxClosed(Exception):
+    pass
+
+
+class Outbox:
+    # Everything sent to a websocket goes through its own bounded queue and a
+    # single writer task, so a slow client only ever stalls itself. Queue
+    # items are (payload, future); send() waits on the future, which the
+    # writer resolves once the frame is on the socket, or fails with
+    # OutboxClosed if it never gets there.
+
+    def __init__(self, websocket: WebSocket, maxsize: int = CHAT_SEND_QUEUE_SIZE,
+                 policy: str = CHAT_OVERFLOW_POLICY):
+        if policy not in ("drop", "disconnect"):
+            raise ValueError(f"Unknown chat overflow policy: {policy}")
+        self.websocket = websocket
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize)
+        self.policy = policy
+        self.dropped = 0
+        self.closed = False
+        self.writer: asyncio.Task | None = None
+
+    def start(self):
+        self.writer = asyncio.create_task(self.drain())
+
+    async def stop(self):
+        self.closed = True
+        if self.writer:
+            self.writer.cancel()
+            try:
+                await self.writer
+            except asyncio.CancelledError:
+                pass
+        self.abandon()
+
+    def abandon(self):
+        # Fails every frame still queued; their senders must not assume
+        # delivery.
+        while not self.queue.empty():
+            item = self.queue.get_nowait()
+            if item is not CLOSE:
+                self.fail(item[1])
+
+    @staticmethod
+    def fail(delivered: asyncio.Future | None):
+        if delivered is not None and not delivered.done():
+            delivered.set_exception(OutboxClosed())
+
+    async def send(self, payload: dict):
+        # Waits for room and then for the frame to be written; used for the
+        # connection's own replay, where blocking only delays this client.
+        if self.closed:
+            raise OutboxClosed()
+        delivered = asyncio.get_running_loop().create_future()
+        await self.queue.put((payload, delivered))
+        await delivered
+
+    async def send_batch(self, messages: list[dict]):
+        # Yields each slice once the client has been sent it.
+        for i in range(0, len(messages), CHAT_BATCH_SIZE):
+            batch = messages[i:i + CHAT_BATCH_SIZE]
+            await self.send({"type": "batch", "messages": batch})
+            yield batch
+
+    async def offer(self, payload: dict):
+        # Never waits; used by broker handlers running on someone else's turn.
+        if self.closed:
+            return
+        try:
+            self.queue.put_nowait((payload, None))
+        except asyncio.QueueFull:
+            self.dropped += 1
+            if self.policy == "disconnect":
+                self.closed = True
+                self.abandon()
+                self.queue.put_nowait(CLOSE)
+
+    async def drain(self):
+        item = None
+        try:
+            while True:
+                item = await self.queue.get()
+                if item is CLOSE:
+                    logger.info("Chat client fell %d frames behind, asking it to resync", self.dropped)
+                    await self.websocket.close(code=RESYNC_CLOSE_CODE, reason="resync")
+                    return
+                payload, delivered = item
+                await self.websocket.send_json(payload)
+                if delivered is not None and not delivered.done():
+                    delivered.set_result(None)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self.closed = True
+        finally:
+            if item is not None and item is not CLOSE:
+                self.fail(item[1])
+            self.abandon()
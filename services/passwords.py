@@ -0,0 +1,62 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv
+from fastapi import HTTPException
+from passlib.context import CryptContext
+from starlette import status
+
+load_dotenv()
+PASSWORD_WORKERS = int(os.getenv("PASSWORD_WORKERS", 2))
+PASSWORD_QUEUE_LIMIT = int(os.getenv("PASSWORD_QUEUE_LIMIT", 32))
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+
+class PasswordHasher:
+    # bcrypt releases the GIL, so a few threads keep it off the event loop.
+    # At most queue_limit operations may be running or waiting; beyond that
+    # callers get an immediate 503 instead of joining a queue that would
+    # time out anyway.
+
+    def __init__(self, workers: int = PASSWORD_WORKERS, queue_limit: int = PASSWORD_QUEUE_LIMIT):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+
+    async def run(self, fn, *args):
+        if self.in_flight >= self.queue_limit:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Too many sign-in attempts right now, try again shortly",
+                headers={"Retry-After": "1"},
+            )
+        self.in_flight += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+        finally:
+            self.in_flight -= 1
+            self.completed += 1
+
+    async def hash(self, password: str) -> str:
+        return await self.run(pwd_context.hash, password)
+
+    async def verify(self, password: str, hashed: str) -> bool:
+        return await self.run(pwd_context.verify, password, hashed)
+
+    def snapshot(self) -> dict:
+        return {
+            "workers": self.workers,
+            "queue_limit": self.queue_limit,
+            "in_flight": self.in_flight,
+            "completed": self.completed,
+            "rejected": self.rejected,
+        }
+
+
+hasher = PasswordHasher()
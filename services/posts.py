@@ -0,0 +1,49 @@
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import Post, PostLike, PostMedia, User
+from services import timeline
+from services.uploads import StoredUpload
+from services.derivatives import attach_variants
+
+
+async def hydrate_posts(db: AsyncSession, posts: list[Post], viewer_id: int) -> list[Post]:
+    if not posts:
+        return posts
+
+    post_ids = [post.id for post in posts]
+
+    liked_ids = set(
+        (await db.scalars(
+            select(PostLike.post_id)
+            .where(PostLike.user_id == viewer_id, PostLike.post_id.in_(post_ids))
+        )).all()
+    )
+
+    for post in posts:
+        post.has_liked = post.id in liked_ids
+
+    await attach_variants(db, posts)
+    return posts
+
+
+async def publish_post(db: AsyncSession, user_id: int, title: str | None, description: str | None,
+                       stored: StoredUpload) -> tuple[Post, User]:
+    # The caller commits. The upload must have been stored with refs=2: the
+    # URL is referenced from both the post and its PostMedia row.
+    new_post = Post(
+        user_id=user_id,
+        title=title,
+        description=description,
+        media_url=stored.url,
+    )
+    db.add(new_post)
+    await db.flush()
+
+    db.add(PostMedia(media_url=stored.url, post_id=new_post.id))
+
+    account = await db.get(User, user_id)
+    account.posts_count += 1
+
+    await timeline.fan_out_post(db, new_post.id, account.followers_count or 0)
+    return new_post, account
@@ -0,0 +1,158 @@
+import os
+import time
+from collections import OrderedDict
+
+from dotenv import load_dotenv
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import User
+from schemas import UserResponse
+
+load_dotenv()
+PROFILE_CACHE_SIZE = int(os.getenv("PROFILE_CACHE_SIZE", 10000))
+PROFILE_CACHE_TTL = int(os.getenv("PROFILE_CACHE_TTL", 60))
+PROFILE_CACHE_URL = os.getenv("PROFILE_CACHE_URL")
+# Far longer than a profile load takes, so a reader never sees its
+# version key expire and restart from zero between reading it and storing.
+PROFILE_VERSION_TTL = 24 * 3600
+
+
+def serialize_profile(account: User) -> bytes:
+    return UserResponse.model_validate(account).model_dump_json().encode()
+
+
+class ProfileCache:
+    # Serialized UserResponse bodies by user id. Kept in this process (TTL +
+    # LRU) or, with PROFILE_CACHE_URL, in a redis-compatible server shared by
+    # all workers, so an invalidation on one worker is seen by the others.
+    # Writers invalidate after commit; the TTL only bounds what the
+    # invalidation cannot see (seeder, reconcile_counts, manual SQL).
+    # A hit runs no query, and get_db's session only takes a pooled
+    # connection on its first statement, so a hit never touches the pool.
+    # A reader takes the version before loading the row and may only store
+    # it if no invalidation bumped the version since. In redis the version
+    # is a per-user counter on the server and the store is a WATCH/MULTI
+    # compare-and-set, so an invalidation from any worker wins.
+
+    def __init__(self, max_size: int = PROFILE_CACHE_SIZE, ttl: int = PROFILE_CACHE_TTL, client=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.client = client
+        self.entries: OrderedDict[int, tuple[bytes, float]] = OrderedDict()
+        # Bumped by every invalidation in memory mode.
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def key(user_id: int) -> str:
+        return f"profile:{user_id}"
+
+    @staticmethod
+    def version_key(user_id: int) -> str:
+        return f"profile:ver:{user_id}"
+
+    async def current_version(self, user_id: int) -> int:
+        if self.client is None:
+            return self.version
+        return int(await self.client.get(self.version_key(user_id)) or 0)
+
+    async def get(self, user_id: int) -> bytes | None:
+        if self.client is not None:
+            body = await self.client.get(self.key(user_id))
+        else:
+            entry = self.entries.get(user_id)
+            body = None
+            if entry is not None:
+                if entry[1] > time.monotonic():
+                    self.entries.move_to_end(user_id)
+                    body = entry[0]
+                else:
+                    del self.entries[user_id]
+        if body is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return body
+
+    async def put(self, user_id: int, body: bytes, version: int):
+        if self.max_size <= 0:
+            return
+        if self.client is not None:
+            from redis.exceptions import WatchError
+
+            async with self.client.pipeline(transaction=True) as pipe:
+                await pipe.watch(self.version_key(user_id))
+                if int(await pipe.get(self.version_key(user_id)) or 0) != version:
+                    return
+                pipe.multi()
+                pipe.set(self.key(user_id), body, ex=self.ttl)
+                try:
+                    await pipe.execute()
+                except WatchError:
+                    pass
+            return
+        if version != self.version:
+            return
+        self.entries[user_id] = (body, time.monotonic() + self.ttl)
+        self.entries.move_to_end(user_id)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    async def invalidate(self, *user_ids: int):
+        self.version += 1
+        self.invalidations += len(user_ids)
+        if self.client is not None:
+            async with self.client.pipeline(transaction=True) as pipe:
+                for user_id in user_ids:
+                    pipe.incr(self.version_key(user_id))
+                    pipe.expire(self.version_key(user_id), PROFILE_VERSION_TTL)
+                    pipe.delete(self.key(user_id))
+                await pipe.execute()
+            return
+        for user_id in user_ids:
+            self.entries.pop(user_id, None)
+
+    async def stop(self):
+        if self.client is not None:
+            await self.client.aclose()
+
+    def snapshot(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "backend": "redis" if self.client is not None else "memory",
+            "size": len(self.entries) if self.client is None else None,
+            "max_size": self.max_size,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+        }
+
+
+def create_profile_cache():
+    if not PROFILE_CACHE_URL:
+        return ProfileCache()
+    try:
+        import redis.asyncio as redis
+    except ImportError:
+        raise RuntimeError("PROFILE_CACHE_URL is set but the 'redis' package is not installed")
+    return ProfileCache(client=redis.from_url(PROFILE_CACHE_URL))
+
+
+profile_cache = create_profile_cache()
+
+
+async def load_profile(db: AsyncSession, user_id: int) -> bytes | None:
+    body = await profile_cache.get(user_id)
+    if body is not None:
+        return body
+    version = await profile_cache.current_version(user_id)
+    account = await db.get(User, user_id)
+    if account is None:
+        return None
+    body = serialize_profile(account)
+    await profile_cache.put(user_id, body, version)
+    return body
@@ -0,0 +1,36 @@
+import os
+
+from dotenv import load_dotenv
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import Reel, ReelLike
+
+load_dotenv()
+BASE_URL = os.getenv("BASE_URL", "http://56.228.35.186")
+
+
+async def serialize_reels(db: AsyncSession, reels: list[Reel], viewer_id: int) -> list[dict]:
+    liked_ids = set()
+    if reels:
+        liked_ids = set(
+            (await db.scalars(
+                select(ReelLike.reel_id)
+                .where(ReelLike.user_id == viewer_id, ReelLike.reel_id.in_([r.id for r in reels]))
+            )).all()
+        )
+
+    return [
+        {
+            "id": r.id,
+            "user_id": r.user_id,
+            "description": r.description,
+            "video_url": r.video_url if r.video_url and r.video_url.startswith("http") else (f"{BASE_URL}{r.video_url}" if r.video_url else None),
+            "like_count": r.like_count,
+            "comment_count": r.comment_count,
+            "created_at": r.created_at,
+            "user": {"id": r.user.id, "username": r.user.username, "pfp_url": r.user.pfp_url},
+            "has_liked": r.id in liked_ids
+        }
+        for r in reels
+    ]
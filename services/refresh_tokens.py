@@ -0,0 +1,102 @@
+import hashlib
+import os
+import secrets
+from datetime import datetime, timedelta, timezone
+
+from dotenv import load_dotenv
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import RefreshToken, User
+
+load_dotenv()
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", 30))
+
+
+class RefreshTokenError(Exception):
+    pass
+
+
+def hash_token(token: str) -> str:
+    # The raw token is 256 random bits, so a plain sha256 is enough to make a
+    # leaked table useless and keeps the lookup a single index probe.
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+async def issue(db: AsyncSession, user_id: int, family_id: str | None = None) -> str:
+    token = secrets.token_urlsafe(32)
+    db.add(RefreshToken(
+        user_id=user_id,
+        family_id=family_id or secrets.token_hex(16),
+        token_hash=hash_token(token),
+        expires_at=datetime.now(timezone.utc) + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS),
+    ))
+    return token
+
+
+async def purge_expired(db: AsyncSession, user_id: int):
+    await db.execute(
+        delete(RefreshToken).where(RefreshToken.user_id == user_id, RefreshToken.expires_at < func.now())
+    )
+
+
+async def revoke_family(db: AsyncSession, family_id: str):
+    await db.execute(
+        update(RefreshToken)
+        .where(RefreshToken.family_id == family_id, RefreshToken.revoked_at.is_(None))
+        .values(revoked_at=func.now())
+    )
+
+
+async def rotate(db: AsyncSession, token: str) -> tuple[User, str]:
+    # Marks the presented token used and issues its successor in the same
+    # family. The conditional UPDATE makes concurrent refreshes of one token
+    # race for a single winner.
+    token_hash = hash_token(token)
+    claimed = (await db.execute(
+        update(RefreshToken)
+        .where(
+            RefreshToken.token_hash == token_hash,
+            RefreshToken.used_at.is_(None),
+            RefreshToken.revoked_at.is_(None),
+            RefreshToken.expires_at > func.now(),
+        )
+        .values(used_at=func.now())
+        .returning(RefreshToken.user_id, RefreshToken.family_id)
+    )).first()
+
+    if claimed is None:
+        existing = await db.scalar(select(RefreshToken).where(RefreshToken.token_hash == token_hash))
+        if existing is not None and existing.used_at is not None and existing.revoked_at is None:
+            # A rotated token came back: someone else holds a copy. End the
+            # whole session rather than guess which holder is legitimate.
+            await revoke_family(db, existing.family_id)
+            await db.commit()
+        raise RefreshTokenError()
+
+    user = await db.get(User, claimed.user_id)
+    if user is None:
+        raise RefreshTokenError()
+    new_token = await issue(db, claimed.user_id, claimed.family_id)
+    await db.commit()
+    return user, new_token
+
+
+async def revoke(db: AsyncSession, token: str) -> bool:
+    family_id = await db.scalar(
+        select(RefreshToken.family_id).where(RefreshToken.token_hash == hash_token(token))
+    )
+    if family_id is None:
+        return False
+    await revoke_family(db, family_id)
+    await db.commit()
+    return True
+
+
+async def revoke_all(db: AsyncSession, user_id: int):
+    await db.execute(
+        update(RefreshToken)
+        .where(RefreshToken.user_id == user_id, RefreshToken.revoked_at.is_(None))
+        .values(revoked_at=func.now())
+    )
+    await db.commit()
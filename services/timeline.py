@@ -0,0 +1,201 @@
+import asyncio
+import logging
+import os
+
+from dotenv import load_dotenv
+from sqlalchemy import delete, literal, select, text, tuple_
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload
+
+from database import AsyncSessionLocal
+from models import Follow, Post, TimelineEntry, User
+
+load_dotenv()
+TIMELINE_MAX_LENGTH = int(os.getenv("TIMELINE_MAX_LENGTH", 800))
+# Authors above this many followers are not fanned out; their posts are
+# merged into each follower's feed at read time instead.
+FANOUT_MAX_FOLLOWERS = int(os.getenv("FANOUT_MAX_FOLLOWERS", 10000))
+FOLLOW_BACKFILL_POSTS = int(os.getenv("FOLLOW_BACKFILL_POSTS", 20))
+TIMELINE_TRIM_INTERVAL = int(os.getenv("TIMELINE_TRIM_INTERVAL", 60))
+TIMELINE_TRIM_BATCH = 500
+
+TRIM_TIMELINES = text("""
+DELETE FROM timeline_entries AS t
+USING (
+    SELECT u.user_id, cut.created_at, cut.post_id
+    FROM unnest(CAST(:user_ids AS INTEGER[])) AS u(user_id)
+    CROSS JOIN LATERAL (
+        SELECT created_at, post_id FROM timeline_entries
+        WHERE user_id = u.user_id
+        ORDER BY created_at DESC, post_id DESC
+        OFFSET :max_length LIMIT 1
+    ) AS cut
+) AS c
+WHERE t.user_id = c.user_id AND (t.created_at, t.post_id) <= (c.created_at, c.post_id)
+""")
+
+# One-off fill for databases that predate timeline_entries: the latest
+# posts of everyone each user follows plus their own, capped per timeline.
+BACKFILL_TIMELINES = f"""
+INSERT INTO timeline_entries (user_id, post_id, author_id, created_at)
+SELECT user_id, post_id, author_id, created_at FROM (
+    SELECT e.*, row_number() OVER (PARTITION BY user_id ORDER BY created_at DESC, post_id DESC) AS position
+    FROM (
+        SELECT f.follower_id AS user_id, p.id AS post_id, p.user_id AS author_id, p.created_at
+        FROM follows AS f
+        JOIN LATERAL (
+            SELECT id, user_id, created_at FROM posts
+            WHERE posts.user_id = f.following_id
+            ORDER BY created_at DESC LIMIT {FOLLOW_BACKFILL_POSTS}
+        ) AS p ON TRUE
+        UNION ALL
+        SELECT user_id, id, user_id, created_at FROM posts
+    ) AS e
+) AS ranked
+WHERE position <= {TIMELINE_MAX_LENGTH}
+ON CONFLICT DO NOTHING
+"""
+
+logger = logging.getLogger(__name__)
+
+
+async def fan_out_post(db: AsyncSession, post_id: int, followers_count: int):
+    columns = ["user_id", "post_id", "author_id", "created_at"]
+    own = select(Post.user_id, Post.id, Post.user_id, Post.created_at).where(Post.id == post_id)
+    trimmer.mark((await db.scalars(
+        insert(TimelineEntry).from_select(columns, own).on_conflict_do_nothing().returning(TimelineEntry.user_id)
+    )).all())
+    if followers_count > FANOUT_MAX_FOLLOWERS:
+        return
+
+    followers = (
+        select(Follow.follower_id, Post.id, Post.user_id, Post.created_at)
+        .join(Follow, Follow.following_id == Post.user_id)
+        .where(Post.id == post_id)
+    )
+    recipients = (await db.scalars(
+        insert(TimelineEntry).from_select(columns, followers).on_conflict_do_nothing().returning(TimelineEntry.user_id)
+    )).all()
+    trimmer.mark(recipients)
+
+
+async def remove_post(db: AsyncSession, post_id: int):
+    await db.execute(delete(TimelineEntry).where(TimelineEntry.post_id == post_id))
+
+
+async def backfill_author(db: AsyncSession, user_id: int, author: User):
+    if (author.followers_count or 0) > FANOUT_MAX_FOLLOWERS:
+        return
+
+    recent = (
+        select(literal(user_id), Post.id, Post.user_id, Post.created_at)
+        .where(Post.user_id == author.id)
+        .order_by(Post.created_at.desc())
+        .limit(FOLLOW_BACKFILL_POSTS)
+    )
+    await db.execute(
+        insert(TimelineEntry)
+        .from_select(["user_id", "post_id", "author_id", "created_at"], recent)
+        .on_conflict_do_nothing()
+    )
+    trimmer.mark([user_id])
+
+
+async def remove_author(db: AsyncSession, user_id: int, author_id: int):
+    await db.execute(
+        delete(TimelineEntry).where(TimelineEntry.user_id == user_id, TimelineEntry.author_id == author_id)
+    )
+
+
+async def trim_timelines(db: AsyncSession, user_ids: list[int]):
+    await db.execute(TRIM_TIMELINES, {"user_ids": user_ids, "max_length": TIMELINE_MAX_LENGTH})
+
+
+def timeline_page_query(user_id: int, cursor: tuple | None, limit: int):
+    entries = select(TimelineEntry.post_id, TimelineEntry.created_at).where(TimelineEntry.user_id == user_id)
+    if cursor:
+        entries = entries.where(tuple_(TimelineEntry.created_at, TimelineEntry.post_id) < cursor)
+    return entries.order_by(TimelineEntry.created_at.desc(), TimelineEntry.post_id.desc()).limit(limit + 1)
+
+
+def large_account_posts_query(user_id: int, cursor: tuple | None, limit: int):
+    large_accounts = (
+        select(Follow.following_id)
+        .join(User, User.id == Follow.following_id)
+        .where(Follow.follower_id == user_id, User.followers_count > FANOUT_MAX_FOLLOWERS)
+    )
+    merged = select(Post.id, Post.created_at).where(Post.user_id.in_(large_accounts))
+    if cursor:
+        merged = merged.where(tuple_(Post.created_at, Post.id) < cursor)
+    return merged.order_by(Post.created_at.desc(), Post.id.desc()).limit(limit + 1)
+
+
+async def read_timeline(db: AsyncSession, user_id: int, cursor: tuple | None, limit: int) -> list[Post]:
+    rows = (await db.execute(timeline_page_query(user_id, cursor, limit))).all()
+    rows += (await db.execute(large_account_posts_query(user_id, cursor, limit))).all()
+
+    newest = sorted({(created_at, post_id) for post_id, created_at in rows}, reverse=True)[:limit + 1]
+    post_ids = [post_id for _, post_id in newest]
+    if not post_ids:
+        return []
+
+    posts = {
+        post.id: post
+        for post in (await db.scalars(
+            select(Post).options(joinedload(Post.user)).where(Post.id.in_(post_ids))
+        )).all()
+    }
+    return [posts[post_id] for post_id in post_ids if post_id in posts]
+
+
+class TimelineTrimmer:
+    # Writers mark the timelines they add entries to; every interval the
+    # marked ones are cut back to TIMELINE_MAX_LENGTH in batches, so the
+    # feed read never writes. Marks live in this worker only: a timeline
+    # whose mark is lost to a restart is trimmed on its next delivery.
+
+    def __init__(self, interval: int = TIMELINE_TRIM_INTERVAL, batch_size: int = TIMELINE_TRIM_BATCH):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.marked: set[int] = set()
+        self.task: asyncio.Task | None = None
+
+    def mark(self, user_ids):
+        self.marked.update(user_ids)
+
+    async def start(self):
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+
+    async def trim(self):
+        user_ids, self.marked = sorted(self.marked), set()
+        for start in range(0, len(user_ids), self.batch_size):
+            batch = user_ids[start:start + self.batch_size]
+            try:
+                async with AsyncSessionLocal() as db:
+                    await trim_timelines(db, batch)
+                    await db.commit()
+            except BaseException:
+                self.mark(user_ids[start:])
+                raise
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.trim()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Timeline trim failed")
+
+
+trimmer = TimelineTrimmer()
@@ -0,0 +1,75 @@
+import hashlib
+import os
+import time
+from collections import OrderedDict
+
+from dotenv import load_dotenv
+
+load_dotenv()
+AUTH_TOKEN_CACHE_SIZE = int(os.getenv("AUTH_TOKEN_CACHE_SIZE", 10000))
+
+
+class Principal(dict):
+    # Still the {"username", "id"} dict every handler indexes into. The
+    # current-account dependency also attaches the User row, loaded into the
+    # request's session, so handlers stop fetching it again.
+    __slots__ = ("account",)
+
+    def __init__(self, username: str, user_id: int, account=None):
+        super().__init__(username=username, id=user_id)
+        self.account = account
+
+
+class TokenCache:
+    # Verified tokens, keyed by their sha256 so raw tokens are never held,
+    # each expiring at its own exp claim. Bounded LRU.
+
+    def __init__(self, max_size: int = AUTH_TOKEN_CACHE_SIZE):
+        self.max_size = max_size
+        self.entries: OrderedDict[bytes, tuple[Principal, float]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(token: str) -> bytes:
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, token: str) -> Principal | None:
+        key = self.key(token)
+        entry = self.entries.get(key)
+        if entry is None or entry[1] <= time.time():
+            if entry is not None:
+                del self.entries[key]
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def put(self, token: str, principal: Principal, expires_at: float):
+        if self.max_size <= 0:
+            return
+        key = self.key(token)
+        self.entries[key] = (principal, expires_at)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def discard(self, token: str):
+        self.entries.pop(self.key(token), None)
+
+    def clear(self):
+        self.entries.clear()
+
+    def snapshot(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self.entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+        }
+
+
+token_cache = TokenCache()
@@ -0,0 +1,129 @@
+import asyncio
+import logging
+import os
+import time
+import uuid
+from pathlib import Path
+
+from dotenv import load_dotenv
+from sqlalchemy import delete, func, select
+
+from database import AsyncSessionLocal
+from models import UploadChunk, UploadSession
+from services.uploads import MEDIA_DIR
+
+load_dotenv()
+UPLOAD_SESSION_TTL = int(os.getenv("UPLOAD_SESSION_TTL", 24 * 3600))
+UPLOAD_GC_INTERVAL = int(os.getenv("UPLOAD_GC_INTERVAL", 600))
+UPLOAD_CHUNK_HINT = 8 * 1024 * 1024
+UPLOAD_MAX_CHUNK = 64 * 1024 * 1024
+WRITE_BUFFER = 1024 * 1024
+
+# Dot-prefixed so the /media router never serves half-finished uploads.
+SESSIONS_DIR = MEDIA_DIR / ".uploads"
+SESSIONS_DIR.mkdir(parents=True, exist_ok=True)
+
+logger = logging.getLogger(__name__)
+
+
+def session_path(session_id: str) -> Path:
+    return SESSIONS_DIR / session_id
+
+
+def chunk_path(session_id: str) -> Path:
+    # Not a session id, so the sweep removes it once stale if its request
+    # died before cleaning up.
+    return SESSIONS_DIR / f"{session_id}.{uuid.uuid4().hex}.part"
+
+
+def allocate(path: Path, size: int):
+    # Sparse file of the final size, so chunks can land in any order.
+    with open(path, "wb") as f:
+        f.truncate(size)
+
+
+def pwrite_all(fd: int, data: bytes, offset: int):
+    view = memoryview(data)
+    while view:
+        written = os.pwrite(fd, view, offset)
+        view = view[written:]
+        offset += written
+
+
+def copy_into(source: Path, fd: int, offset: int):
+    with open(source, "rb") as f:
+        while block := f.read(WRITE_BUFFER):
+            pwrite_all(fd, block, offset)
+            offset += len(block)
+
+
+def merge_ranges(chunks: list[tuple[int, int]]) -> list[list[int]]:
+    # (offset, length) rows -> sorted, non-overlapping [start, end) ranges
+    merged: list[list[int]] = []
+    for offset, length in sorted(chunks):
+        end = offset + length
+        if merged and offset <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([offset, end])
+    return merged
+
+
+async def received_ranges(db, session_id: str) -> list[list[int]]:
+    rows = (await db.execute(
+        select(UploadChunk.offset, UploadChunk.length).where(UploadChunk.session_id == session_id)
+    )).all()
+    return merge_ranges([(row.offset, row.length) for row in rows])
+
+
+async def expire_sessions() -> int:
+    async with AsyncSessionLocal() as db:
+        expired = (await db.scalars(
+            delete(UploadSession).where(UploadSession.expires_at < func.now()).returning(UploadSession.id)
+        )).all()
+        live = set((await db.scalars(select(UploadSession.id))).all())
+        await db.commit()
+    await asyncio.to_thread(sweep_files, expired, live)
+    return len(expired)
+
+
+def sweep_files(expired: list[str], live: set[str]):
+    for session_id in expired:
+        session_path(session_id).unlink(missing_ok=True)
+    # Files whose session row never committed or was removed by hand.
+    cutoff = time.time() - UPLOAD_SESSION_TTL
+    for entry in os.scandir(SESSIONS_DIR):
+        if entry.name not in live and entry.stat().st_mtime < cutoff:
+            os.unlink(entry.path)
+
+
+class UploadJanitor:
+    def __init__(self, interval: int = UPLOAD_GC_INTERVAL):
+        self.interval = interval
+        self.task: asyncio.Task | None = None
+
+    async def start(self):
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+
+    async def run(self):
+        while True:
+            try:
+                removed = await expire_sessions()
+                if removed:
+                    logger.info("Removed %d expired upload sessions", removed)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Upload session cleanup failed")
+            await asyncio.sleep(self.interval)
+
+
+janitor = UploadJanitor()
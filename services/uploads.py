@@ -0,0 +1,202 @@
+import asyncio
+import hashlib
+import os
+import re
+import shutil
+import uuid
+from pathlib import Path
+
+from dotenv import load_dotenv
+from fastapi import HTTPException, UploadFile
+from sqlalchemy import func, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette import status
+
+from models import MediaBlob
+
+load_dotenv()
+BASE_DIR = Path(__file__).resolve().parent.parent
+MEDIA_DIR = BASE_DIR / Path(os.getenv("MEDIA_DIR", "media"))
+MEDIA_DIR.mkdir(parents=True, exist_ok=True)
+CAS_DIR = MEDIA_DIR / "cas"
+BASE_URL = os.getenv("BASE_URL", "http://56.228.35.186")
+
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+MAX_IMAGE_SIZE = 20 * 1024 * 1024
+MAX_VIDEO_SIZE = 400 * 1024 * 1024
+
+ALLOWED_MEDIA = [
+    "image/jpeg", "image/png", "image/gif", "video/mp4", "image/webp",
+    "image/avif", "image/svg+xml", "video/quicktime", "image/bmp",
+    "image/tiff", "image/heic"
+]
+
+BLOB_URL_RE = re.compile(r"/media/cas/[0-9a-f]{2}/([0-9a-f]{64})[^/]*$")
+
+
+class StoredUpload:
+    __slots__ = ("path", "url", "size", "sha256", "content_type")
+
+    def __init__(self, path: Path, url: str, size: int, sha256: str, content_type: str):
+        self.path = path
+        self.url = url
+        self.size = size
+        self.sha256 = sha256
+        self.content_type = content_type
+
+
+def max_size_for(content_type: str) -> int:
+    return MAX_VIDEO_SIZE if "video" in content_type else MAX_IMAGE_SIZE
+
+
+def too_large(max_size: int) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        detail=f"File too large. Max size: {max_size / (1024 * 1024):.0f}MB"
+    )
+
+
+def blob_path(sha256: str, ext: str) -> Path:
+    return CAS_DIR / sha256[:2] / f"{sha256}{ext}"
+
+
+def blob_url(sha256: str, ext: str) -> str:
+    return f"{BASE_URL}/media/cas/{sha256[:2]}/{sha256}{ext}"
+
+
+def blob_sha(url: str | None) -> str | None:
+    match = BLOB_URL_RE.search(url or "")
+    return match.group(1) if match else None
+
+
+async def save_upload(db: AsyncSession, media: UploadFile, refs: int = 1, default_ext: str = "") -> StoredUpload:
+    # Media is stored once per distinct content under MEDIA_DIR/cas/ab/<sha256><ext>
+    # and media_blobs counts the rows pointing at it. The request body is
+    # already spooled by the time we get here, so it is hashed in place (in a
+    # worker thread, stopping at the size limit) and copied into the store
+    # only if those bytes are new; a repeat upload writes nothing. The
+    # reference is taken in the caller's transaction; if that rolls back, the
+    # file is left for the media reconciler.
+    if not media or not media.filename:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="No media provided")
+    if media.content_type not in ALLOWED_MEDIA:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Unsupported media type: {media.content_type}")
+
+    max_size = max_size_for(media.content_type)
+    if media.size is not None and media.size > max_size:
+        raise too_large(max_size)
+
+    sha256, size = await asyncio.to_thread(hash_file, media.file, max_size)
+    if size > max_size:
+        raise too_large(max_size)
+
+    ext = (os.path.splitext(media.filename)[1] or default_ext).lower()
+    ext = await acquire_blob(db, sha256, ext, size, media.content_type, refs)
+    path = blob_path(sha256, ext)
+    if not await asyncio.to_thread(path.exists):
+        await asyncio.to_thread(copy_into_place, media.file, path)
+    return StoredUpload(
+        path=path,
+        url=blob_url(sha256, ext),
+        size=size,
+        sha256=sha256,
+        content_type=media.content_type,
+    )
+
+
+async def store_blob(db: AsyncSession, source: Path, sha256: str, size: int, ext: str, content_type: str, refs: int = 1) -> StoredUpload:
+    # source is a finished file under MEDIA_DIR, moved into the store. When
+    # the content is already there nothing is written and source is left to
+    # the caller.
+    ext = await acquire_blob(db, sha256, ext, size, content_type, refs)
+    path = blob_path(sha256, ext)
+    if not await asyncio.to_thread(path.exists):
+        await asyncio.to_thread(move_into_place, source, path)
+    return StoredUpload(
+        path=path,
+        url=blob_url(sha256, ext),
+        size=size,
+        sha256=sha256,
+        content_type=content_type,
+    )
+
+
+async def acquire_blob(db: AsyncSession, sha256: str, ext: str, size: int, content_type: str, refs: int = 1) -> str:
+    stmt = insert(MediaBlob).values(
+        sha256=sha256,
+        ext=ext,
+        size=size,
+        content_type=content_type,
+        ref_count=refs,
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[MediaBlob.sha256],
+        set_={"ref_count": MediaBlob.ref_count + stmt.excluded.ref_count, "updated_at": func.now()},
+    ).returning(MediaBlob.ext)
+    return await db.scalar(stmt)
+
+
+async def release_media(db: AsyncSession, url: str | None, refs: int = 1) -> str | None:
+    # Drops the reference in the caller's transaction. Uploads from before
+    # the content store own their file outright; their URL is returned for
+    # the caller to remove_media() once the transaction has committed.
+    sha256 = blob_sha(url)
+    if sha256 is None:
+        return url
+    await db.execute(
+        update(MediaBlob)
+        .where(MediaBlob.sha256 == sha256)
+        .values(ref_count=func.greatest(MediaBlob.ref_count - refs, 0))
+    )
+    return None
+
+
+def media_path(url: str | None) -> Path | None:
+    prefix = f"{BASE_URL}/media/"
+    if not url or not url.startswith(prefix):
+        return None
+    path = (MEDIA_DIR / url[len(prefix):]).resolve()
+    if not path.is_relative_to(MEDIA_DIR.resolve()):
+        return None
+    return path
+
+
+async def remove_media(url: str | None):
+    path = media_path(url)
+    if path is not None:
+        await asyncio.to_thread(path.unlink, missing_ok=True)
+
+
+def hash_file(f, max_size: int) -> tuple[str, int]:
+    digest = hashlib.sha256()
+    size = 0
+    f.seek(0)
+    while chunk := f.read(UPLOAD_CHUNK_SIZE):
+        size += len(chunk)
+        if size > max_size:
+            break
+        digest.update(chunk)
+    return digest.hexdigest(), size
+
+
+def copy_into_place(f, path: Path):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = CAS_DIR / f".{uuid.uuid4().hex}.part"
+    try:
+        f.seek(0)
+        with open(temp_path, "wb") as out:
+            shutil.copyfileobj(f, out, UPLOAD_CHUNK_SIZE)
+            out.flush()
+            os.fsync(out.fileno())
+        os.replace(temp_path, path)
+    finally:
+        temp_path.unlink(missing_ok=True)
+
+
+def move_into_place(source: Path, path: Path):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(source, "rb") as f:
+        os.fsync(f.fileno())
+    os.replace(source, path)
+